@@ -6,6 +6,8 @@
 
 #include <sys/types.h>
 
+#include <algorithm>
+#include <array>
 #include <cstddef>
 #include <cstdint>
 #include <cstring>
@@ -786,7 +788,12 @@ class TrieFSMBuilderImpl {
       bool allow_overlap,
       bool add_back_edges
   );
-  void AddBackEdges(FSM* fsm, int start, const std::unordered_set<int>& ends);
+  void AddBackEdges(
+      FSM* fsm,
+      int start,
+      const std::unordered_set<int>& ends,
+      std::unordered_set<int32_t>* dead_state_set
+  );
 };
 
 std::optional<FSMWithStartEnd> TrieFSMBuilderImpl::Build(
@@ -862,8 +869,9 @@ std::optional<FSMWithStartEnd> TrieFSMBuilderImpl::Build(
       dead_state_set.insert(current_state);
     }
 
-    // Add back edges.
-    AddBackEdges(&fsm, start, ends);
+    // Add back edges. The states whose suffix is an excluded pattern are also added to the dead
+    // state set.
+    AddBackEdges(&fsm, start, ends, &dead_state_set);
 
     // Remove the edges to excluded end states.
     if (dead_state_set.size() != 0) {
@@ -890,68 +898,94 @@ std::optional<FSMWithStartEnd> TrieFSMBuilderImpl::Build(
   return FSMWithStartEnd(fsm, start, is_end_state);
 }
 
-void TrieFSMBuilderImpl::AddBackEdges(FSM* fsm, int start, const std::unordered_set<int>& ends) {
+void TrieFSMBuilderImpl::AddBackEdges(
+    FSM* fsm,
+    int start,
+    const std::unordered_set<int>& ends,
+    std::unordered_set<int32_t>* dead_state_set
+) {
   // Build an Aho-Corasick automaton by adding back edges.
-  // When matching on the trie fails, we should go back to the start state and
-  // find the next match. Back edges represent such state transitions.
-
-  auto f_add_range_edges = [&](int node, std::set<FSMEdge, FSMEdgeRangeComparator>& cur_edges_set) {
-    cur_edges_set.insert(FSMEdge(-1, -1, 0));
-    cur_edges_set.insert(FSMEdge(256, 256, 0));
-    XGRAMMAR_DCHECK(cur_edges_set.size() >= 2);
-    for (auto it = std::next(cur_edges_set.begin()); it != cur_edges_set.end(); ++it) {
-      FSMEdge prev_edge = *std::prev(it);
-      XGRAMMAR_DCHECK(prev_edge.max < it->min);
-      if (prev_edge.max + 1 != it->min) {
-        auto new_edge = FSMEdge(prev_edge.max + 1, it->min - 1, start);
-        // The new edge should be inserted before the current edge to avoid infinite loop.
-        XGRAMMAR_DCHECK(new_edge < *it);
-        cur_edges_set.insert(new_edge);
-      }
-    }
-
-    // Remove first and last element of cur_edges_set
-    XGRAMMAR_DCHECK(*cur_edges_set.begin() == FSMEdge(-1, -1, 0));
-    XGRAMMAR_DCHECK(*std::prev(cur_edges_set.end()) == FSMEdge(256, 256, 0));
-    cur_edges_set.erase(cur_edges_set.begin());
-    cur_edges_set.erase(std::prev(cur_edges_set.end()));
-
-    XGRAMMAR_DCHECK(cur_edges_set.begin()->min == 0);
-    XGRAMMAR_DCHECK(std::prev(cur_edges_set.end())->max == 255);
-  };
-
-  for (int i = 0; i < fsm->NumStates(); i++) {
-    if (i == start || ends.count(i) > 0) {
-      continue;
+  // When matching on the trie fails, we should go to the failure state, i.e. the longest proper
+  // suffix of the matched string that is still a trie state, and find the next match there. Back
+  // edges represent such state transitions, so each input byte takes exactly one transition.
+  int num_states = fsm->NumStates();
+  std::vector<int32_t> failure(num_states, start);
+  // The transitions of each state as range edges sorted by byte. Consecutive bytes with the same
+  // target share one range, so the memory is bounded by the trie edges and the failure links
+  // instead of 256 targets per state.
+  std::vector<std::vector<FSMEdge>> transitions(num_states);
+  // The output state of each state, i.e. the end state of the longest pattern or excluded pattern
+  // that is a suffix of the string of the state, or -1 if there is none. Reaching a state means
+  // that its output pattern has just been matched.
+  std::vector<int32_t> output(num_states, -1);
+
+  // Step 1. Visit the trie in BFS order, so the failure state of a state, which is shallower, is
+  // complete before the state itself. The transitions of a state start as those of its failure
+  // state, then its trie edges override them. Only one state is expanded to a byte table at a
+  // time.
+  std::array<int32_t, 256> row;
+  std::vector<int32_t> queue = {start};
+  for (size_t i = 0; i < queue.size(); ++i) {
+    int state = queue[i];
+    if (state == start) {
+      row.fill(start);
+    } else {
+      for (const auto& edge : transitions[failure[state]]) {
+        std::fill(row.begin() + edge.min, row.begin() + edge.max + 1, edge.target);
+      }
     }
-    std::vector<FSMEdge>& cur_edges = fsm->GetEdges(i);
-    XGRAMMAR_DCHECK(cur_edges.size() > 0);
-    std::set<FSMEdge, FSMEdgeRangeComparator> cur_edges_set(cur_edges.begin(), cur_edges.end());
-
-    // Step 1. Add edges in the edges of the start state.
-    // For start--(c)-->t, add i--(c)-->t.
-    const auto& root_edges = fsm->GetEdges(start);
-    for (const auto& root_edge : root_edges) {
-      XGRAMMAR_DCHECK(root_edge.min == root_edge.max);
-      if (cur_edges_set.count(root_edge) == 0) {
-        cur_edges_set.insert(root_edge);
+    for (const auto& edge : fsm->GetEdges(state)) {
+      XGRAMMAR_DCHECK(edge.min == edge.max);
+      int child = edge.target;
+      failure[child] = state == start ? start : row[edge.min];
+      output[child] = ends.count(child) > 0 ? child : output[failure[child]];
+      queue.push_back(child);
+    }
+    for (const auto& edge : fsm->GetEdges(state)) {
+      row[edge.min] = edge.target;
+    }
+    int range_begin = 0;
+    for (int ch = 1; ch <= 256; ++ch) {
+      if (ch == 256 || row[ch] != row[range_begin]) {
+        transitions[state].emplace_back(range_begin, ch - 1, row[range_begin]);
+        range_begin = ch;
       }
     }
+  }
 
-    // Step 2. Add i--(c)-->start for c not in the edge set of i.
-    f_add_range_edges(i, cur_edges_set);
-
-    // Step 3. Update the edges of i.
-    cur_edges.clear();
-    cur_edges.insert(cur_edges.end(), cur_edges_set.begin(), cur_edges_set.end());
+  // Step 2. A non-end state whose output is an end state is the same as that end state, since
+  // the pattern of the end state is matched first, so the transitions to it are redirected to the
+  // end state. A non-end state whose output is an excluded pattern is dead as well.
+  std::vector<int32_t> redirect(num_states);
+  for (int state = 0; state < num_states; ++state) {
+    redirect[state] = output[state] == -1 ? state : output[state];
+  }
+  for (int state : queue) {
+    if (output[state] != -1 && dead_state_set->count(output[state]) > 0) {
+      dead_state_set->insert(state);
+    }
   }
 
-  // Finally, add range edges to the start state.
-  std::vector<FSMEdge>& start_edges = fsm->GetEdges(start);
-  std::set<FSMEdge, FSMEdgeRangeComparator> start_edges_set(start_edges.begin(), start_edges.end());
-  f_add_range_edges(start, start_edges_set);
-  start_edges.clear();
-  start_edges.insert(start_edges.end(), start_edges_set.begin(), start_edges_set.end());
+  // Step 3. Replace the edges of the non-end states with the transitions. The end states keep
+  // their trie edges. The dead states and the redirected states get no edges.
+  for (int state : queue) {
+    if (state != start && ends.count(state) > 0) {
+      continue;
+    }
+    std::vector<FSMEdge>& edges = fsm->GetEdges(state);
+    edges.clear();
+    if (redirect[state] != state) {
+      continue;
+    }
+    for (const auto& edge : transitions[state]) {
+      int target = redirect[edge.target];
+      if (!edges.empty() && edges.back().target == target) {
+        edges.back().max = edge.max;
+      } else {
+        edges.emplace_back(edge.min, edge.max, target);
+      }
+    }
+  }
 }
 
 std::optional<FSMWithStartEnd> TrieFSMBuilder::Build(
@@ -42,7 +42,8 @@ class TrieFSMBuilder {
    * other). It does not allow empty patterns either. If false and there is overlap, will return
    * std::nullopt.
    * \param add_back_edges Whether to add back edges to the FSM. This complements the trie to an
-   * Aho-Corasick automaton.
+   * Aho-Corasick automaton. The pattern or excluded pattern that is matched first wins: a state
+   * that has one as a suffix is replaced by its end state.
    * \return If success, the FSM with start and end states. Otherwise, std::nullopt.
    */
   static std::optional<FSMWithStartEnd> Build(
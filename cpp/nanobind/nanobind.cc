@@ -401,6 +401,54 @@ NB_MODULE(xgrammar_bindings, m) {
           nb::arg("matcher"),
           nb::arg("bitmask"),
           nb::call_guard<nb::gil_scoped_release>()
+      )
+      .def(
+          "_fill_next_token_bitmask_for_prefixes",
+          [](GrammarMatcher& matcher,
+             const std::variant<nb::bytes, std::string>& input_str,
+             nb::ndarray<> bitmask) {
+            std::string input_str_converted;
+            if (std::holds_alternative<std::string>(input_str)) {
+              input_str_converted = std::get<std::string>(input_str);
+            } else {
+              const auto& input_bytes = std::get<nb::bytes>(input_str);
+              input_str_converted = std::string(input_bytes.c_str(), input_bytes.size());
+            }
+            static_assert(sizeof(bitmask) == sizeof(void*) + sizeof(nb::dlpack::dltensor));
+            DLTensor* bitmask_ptr =
+                reinterpret_cast<DLTensor*>(reinterpret_cast<char*>(&bitmask) + sizeof(void*));
+            nb::gil_scoped_release release;
+            std::vector<int64_t> fill_durations_ns;
+            auto need_apply = FillNextTokenBitmaskForPrefixes(
+                matcher, input_str_converted, bitmask_ptr, &fill_durations_ns
+            );
+            return std::make_pair(std::move(need_apply), std::move(fill_durations_ns));
+          },
+          nb::arg("matcher"),
+          nb::arg("input_str"),
+          nb::arg("bitmask")
+      )
+      .def(
+          "_accept_strings_with_reset",
+          [](GrammarMatcher& matcher,
+             const std::vector<std::variant<nb::bytes, std::string>>& input_strs,
+             bool require_termination) {
+            std::vector<std::string> input_strs_converted;
+            input_strs_converted.reserve(input_strs.size());
+            for (const auto& input_str : input_strs) {
+              if (std::holds_alternative<std::string>(input_str)) {
+                input_strs_converted.push_back(std::get<std::string>(input_str));
+              } else {
+                const auto& input_bytes = std::get<nb::bytes>(input_str);
+                input_strs_converted.emplace_back(input_bytes.c_str(), input_bytes.size());
+              }
+            }
+            nb::gil_scoped_release release;
+            return AcceptStringsWithReset(matcher, input_strs_converted, require_termination);
+          },
+          nb::arg("matcher"),
+          nb::arg("input_strs"),
+          nb::arg("require_termination")
       );
 
   auto pyGrammarFunctorModule = pyTestingModule.def_submodule("grammar_functor");
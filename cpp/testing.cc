@@ -6,6 +6,7 @@
 
 #include <xgrammar/xgrammar.h>
 
+#include <chrono>
 #include <cstdint>
 #include <sstream>
 #include <string>
@@ -153,4 +154,62 @@ void TraverseDraftTree(
   );
 }
 
+std::vector<uint8_t> FillNextTokenBitmaskForPrefixes(
+    GrammarMatcher& matcher,
+    const std::string& input_str,
+    DLTensor* bitmask,
+    std::vector<int64_t>* fill_durations_ns
+) {
+  XGRAMMAR_CHECK(bitmask->dtype.code == kDLInt && bitmask->dtype.bits == 32)
+      << "The bitmask tensor must be int32";
+  XGRAMMAR_CHECK(bitmask->ndim == 2) << "The bitmask tensor must be 2D";
+  XGRAMMAR_CHECK(bitmask->shape[0] >= static_cast<int64_t>(input_str.size()))
+      << "The bitmask tensor must have at least " << input_str.size() << " rows, but got "
+      << bitmask->shape[0];
+
+  std::vector<uint8_t> need_apply;
+  need_apply.reserve(input_str.size());
+  if (fill_durations_ns != nullptr) {
+    fill_durations_ns->clear();
+    fill_durations_ns->reserve(input_str.size());
+  }
+  for (int i = 0; i < static_cast<int>(input_str.size()); ++i) {
+    if (fill_durations_ns != nullptr) {
+      auto start = std::chrono::steady_clock::now();
+      need_apply.push_back(matcher.FillNextTokenBitmask(bitmask, i));
+      auto end = std::chrono::steady_clock::now();
+      fill_durations_ns->push_back(
+          std::chrono::duration_cast<std::chrono::nanoseconds>(end - start).count()
+      );
+    } else {
+      need_apply.push_back(matcher.FillNextTokenBitmask(bitmask, i));
+    }
+    if (!matcher.AcceptString(input_str.substr(i, 1))) {
+      // Only report the prefixes that can be extended by the next input byte
+      need_apply.pop_back();
+      if (fill_durations_ns != nullptr) {
+        fill_durations_ns->pop_back();
+      }
+      break;
+    }
+  }
+  return need_apply;
+}
+
+std::vector<uint8_t> AcceptStringsWithReset(
+    GrammarMatcher& matcher, const std::vector<std::string>& input_strs, bool require_termination
+) {
+  std::vector<uint8_t> results;
+  results.reserve(input_strs.size());
+  for (const auto& input_str : input_strs) {
+    matcher.Reset();
+    bool accepted = matcher.AcceptString(input_str);
+    if (accepted && require_termination) {
+      accepted = matcher.IsTerminated();
+    }
+    results.push_back(accepted);
+  }
+  return results;
+}
+
 }  // namespace xgrammar
@@ -47,6 +47,43 @@ void TraverseDraftTree(
     DLTensor* bitmask
 );
 
+/*!
+ * \brief Fill the next token bitmask for every prefix of the input string, accepting the input
+ * byte by byte.
+ *
+ * Row i of the bitmask is filled right after the first i bytes are accepted. The function stops
+ * at the first byte the matcher rejects, so the matcher has accepted the whole input string iff
+ * the returned vector has input_str.size() elements.
+ *
+ * \param matcher The grammar matcher to use.
+ * \param input_str The input string.
+ * \param bitmask DLTensor to store the bitmasks (2D: at least input_str.size() x bitmask_size).
+ * \param fill_durations_ns If not null, it is filled with the time in nanoseconds spent in each
+ * FillNextTokenBitmask call.
+ * \return Whether the bitmask of each accepted prefix needs to be applied, i.e. the return values
+ * of FillNextTokenBitmask.
+ */
+std::vector<uint8_t> FillNextTokenBitmaskForPrefixes(
+    GrammarMatcher& matcher,
+    const std::string& input_str,
+    DLTensor* bitmask,
+    std::vector<int64_t>* fill_durations_ns = nullptr
+);
+
+/*!
+ * \brief Check whether the matcher accepts each of the input strings. The matcher is reset before
+ * each string, so all strings are matched from the initial state.
+ *
+ * \param matcher The grammar matcher to use.
+ * \param input_strs The input strings.
+ * \param require_termination Whether the matcher must also be terminated after accepting a
+ * string for the string to count as accepted.
+ * \return Whether each input string is accepted.
+ */
+std::vector<uint8_t> AcceptStringsWithReset(
+    GrammarMatcher& matcher, const std::vector<std::string>& input_strs, bool require_termination
+);
+
 }  // namespace xgrammar
 
 #endif  // XGRAMMAR_TESTING_H_
@@ -134,7 +134,7 @@ def _get_matcher_from_grammar(grammar: Union[Grammar, str], **kwargs) -> Grammar
 
 def _is_grammar_accept_string(
     grammar: Union[Grammar, str],
-    input_str: str,
+    input_str: Union[str, bytes],
     *,
     debug_print: bool = False,
     print_time: bool = False,
@@ -146,8 +146,8 @@ def _is_grammar_accept_string(
     ----------
     grammar : Union[Grammar, str]
         The grammar to check. Can be either a Grammar object or a BNF grammar string.
-    input_str : str
-        The input string to check.
+    input_str : Union[str, bytes]
+        The input string to check. Bytes are passed to the matcher as-is, without re-encoding.
     debug_print : bool, default: False
         Whether to print debug information during matching.
     print_time : bool, default: False
@@ -178,6 +178,77 @@ def _is_grammar_accept_string(
     return grammar_matcher.is_terminated()
 
 
+def _are_grammar_accept_strings(
+    grammar: Union[Grammar, str],
+    input_strs: List[Union[str, bytes]],
+    *,
+    debug_print: bool = False,
+    require_termination: bool = True,
+) -> List[bool]:
+    """Check if a grammar accepts each of the strings. For test purposes. Unlike calling
+    _is_grammar_accept_string for each string, the grammar is compiled once and the matcher is
+    reset between the strings.
+
+    Parameters
+    ----------
+    grammar : Union[Grammar, str]
+        The grammar to check. Can be either a Grammar object or a BNF grammar string.
+    input_strs : List[Union[str, bytes]]
+        The input strings to check.
+    debug_print : bool, default: False
+        Whether to print debug information during matching.
+    require_termination : bool, default: True
+        Whether the matcher must be terminated after accepting a string.
+
+    Returns
+    -------
+    List[bool]
+        Whether the grammar accepts each of the strings.
+    """
+    grammar_matcher = _get_matcher_from_grammar(grammar)
+    if not debug_print:
+        return _accept_strings_with_reset(
+            grammar_matcher, input_strs, require_termination=require_termination
+        )
+    results = []
+    for input_str in input_strs:
+        grammar_matcher.reset()
+        accepted = grammar_matcher.accept_string(input_str, debug_print=debug_print)
+        if accepted and require_termination:
+            accepted = grammar_matcher.is_terminated()
+        results.append(accepted)
+    return results
+
+
+def _accept_strings_with_reset(
+    matcher: GrammarMatcher,
+    input_strs: List[Union[str, bytes]],
+    *,
+    require_termination: bool = True,
+) -> List[bool]:
+    """Check if the matcher accepts each of the strings in one call. The matcher is reset before
+    each string. The loop runs in C++ without the GIL. For test purposes.
+
+    Parameters
+    ----------
+    matcher : GrammarMatcher
+        The grammar matcher to use.
+    input_strs : List[Union[str, bytes]]
+        The input strings to check.
+    require_termination : bool, default: True
+        Whether the matcher must be terminated after accepting a string.
+
+    Returns
+    -------
+    List[bool]
+        Whether the matcher accepts each of the strings.
+    """
+    results = _core.testing._accept_strings_with_reset(
+        matcher._handle, input_strs, require_termination
+    )
+    return [bool(x) for x in results]
+
+
 def _get_masked_tokens_from_bitmask(
     bitmask: torch.Tensor, vocab_size: int, index: int = 0
 ) -> List[int]:
@@ -383,6 +454,46 @@ def _traverse_draft_tree(
     )
 
 
+def _fill_next_token_bitmask_for_prefixes(
+    matcher: GrammarMatcher,
+    input_str: Union[str, bytes],
+    token_bitmask: torch.Tensor,
+    *,
+    return_durations: bool = False,
+) -> Union[List[bool], Tuple[List[bool], List[int]]]:
+    """Fill the next token bitmask for every prefix of the input string in one call. Row i of
+    the bitmask is filled after the first i bytes of the input are accepted. The matcher accepts
+    the input string in the process and stops at the first rejected byte, so the whole string is
+    accepted iff one result is returned per byte. The loop runs in C++ without the GIL.
+
+    Parameters
+    ----------
+    matcher : GrammarMatcher
+        The grammar matcher to use.
+    input_str : Union[str, bytes]
+        The input string.
+    token_bitmask : torch.Tensor
+        2D int32 tensor with at least len(input_str) rows (in bytes) to store the bitmasks.
+    return_durations : bool, default: False
+        Whether to also return the time in nanoseconds spent filling each bitmask.
+
+    Returns
+    -------
+    need_apply : List[bool]
+        Whether the bitmask of each accepted prefix needs to be applied.
+    durations : List[int]
+        The time in nanoseconds spent filling each bitmask. Only returned if return_durations
+        is True.
+    """
+    need_apply, durations = _core.testing._fill_next_token_bitmask_for_prefixes(
+        matcher._handle, input_str, token_bitmask
+    )
+    need_apply = [bool(x) for x in need_apply]
+    if return_durations:
+        return need_apply, durations
+    return need_apply
+
+
 class GrammarFunctor:
     """A utility class for transforming grammars. These methods are called during grammar parsing.
     For test purposes."""
@@ -7,12 +7,42 @@ try:
 except ModuleNotFoundError:
     PARALLEL_RUN_AVAILABLE = False
 
+try:
+    import xdist  # noqa: F401
+
+    XDIST_AVAILABLE = True
+except ModuleNotFoundError:
+    XDIST_AVAILABLE = False
+
 
 def pytest_configure(config):
     if not PARALLEL_RUN_AVAILABLE:
         config.addinivalue_line(
             "markers", "thread_unsafe: mark the test function as single-threaded"
         )
+    if not XDIST_AVAILABLE:
+        config.addinivalue_line(
+            "markers", "xdist_group(name): run the tests of a group on the same xdist worker"
+        )
+
+
+def pytest_collection_modifyitems(config, items):
+    # pytest-benchmark runs the benchmarks by default, which would time them in every test run.
+    # Only run them when asked with --benchmark-enable. Without the plugin, the option does not
+    # exist and the benchmarks are always skipped.
+    if config.getoption("benchmark_enable", default=False):
+        return
+    skip_benchmark = pytest.mark.skip(reason="benchmarks only run with --benchmark-enable")
+    for item in items:
+        if "benchmark" in getattr(item, "fixturenames", ()):
+            item.add_marker(skip_benchmark)
+
+
+def pytest_make_parametrize_id(config, val, argname):
+    # Expected grammars span many lines; keep them out of the test ids
+    if argname == "expected_grammar":
+        return argname
+    return None
 
 
 if not PARALLEL_RUN_AVAILABLE:
@@ -54,6 +54,22 @@ TEST(XGrammarFSMBuilderTest, TestTrieFSMBuilder) {
   EXPECT_EQ(fsm.GetFsm().GetNextState(16, 'e'), -1);
 }
 
+TEST(XGrammarFSMBuilderTest, TestTrieFSMBuilderBackEdges) {
+  // "b" is a suffix of "ab", a prefix of "abc". It is matched first, so the state of "ab" is
+  // replaced by the end state of "b". The state of the excluded "Z" is dead.
+  auto fsm_result = TrieFSMBuilder::Build({"abc", "b"}, {"Z"}, nullptr, false, true);
+  EXPECT_TRUE(fsm_result.has_value());
+  auto fsm = std::move(fsm_result).value();
+  auto fsm_printed = fsm.ToString();
+  std::string expected_fsm_printed = R"(FSM(num_states=6, start=0, end=[3, 4, 5], edges=[
+0: [[\0-Y]->0, [[-`]->0, 'a'->1, 'b'->4, [c-\xff]->0]
+1: [[\0-Y]->0, [[-`]->0, 'a'->1, 'b'->4, [c-\xff]->0]
+4: []
+]))";
+
+  EXPECT_EQ(fsm_printed, expected_fsm_printed);
+}
+
 TEST(XGrammarFSMBuilderTest, TestTagDispatchFSMBuilder1) {
   // Case 1. stop_eos = true, loop_after_dispatch = true
   Grammar::Impl::TagDispatch tag_dispatch = {
@@ -128,7 +144,7 @@ TEST(XGrammarFSMBuilderTest, TestTagDispatchFSMBuilder3) {
   std::string expected_fsm_printed = R"(FSM(num_states=13, start=0, end=[9, 12], edges=[
 0: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
 1: [[\0-d]->0, 'e'->2, [f-g]->0, 'h'->1, 'i'->4, [j-n]->0, 'o'->8, [p-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
-2: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-k]->0, 'l'->3, [m-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
+2: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-k]->0, 'l'->3, [m-n]->0, 'o'->11, [p-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
 3: [Rule(1)->0]
 4: [Rule(2)->0]
 5: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-\x92]->0, '\x93'->6, [\x94-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
@@ -161,7 +177,7 @@ TEST(XGrammarFSMBuilderTest, TestTagDispatchFSMBuilder4) {
       R"(FSM(num_states=20, start=0, end=[9, 12, 16, 19], edges=[
 0: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
 1: [[\0-d]->0, 'e'->2, [f-g]->0, 'h'->1, 'i'->4, [j-n]->0, 'o'->8, [p-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
-2: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-k]->0, 'l'->3, [m-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
+2: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-k]->0, 'l'->3, [m-n]->0, 'o'->11, [p-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
 3: [Rule(1)->13]
 4: [Rule(2)->13]
 5: [[\0-d]->0, 'e'->10, [f-g]->0, 'h'->1, [i-\x92]->0, '\x93'->6, [\x94-\xe4]->0, '\xe5'->5, [\xe6-\xff]->0]
@@ -183,6 +199,53 @@ TEST(XGrammarFSMBuilderTest, TestTagDispatchFSMBuilder4) {
 
   EXPECT_EQ(fsm_printed, expected_fsm_printed);
 }
+TEST(XGrammarFSMBuilderTest, TestTagDispatchFSMBuilder5) {
+  // Case 5. Overlapping triggers. "b" is matched inside "abc" and dispatches first.
+  Grammar::Impl::TagDispatch tag_dispatch = {
+      /* tag_rule_pairs = */ {{"abc", 1}, {"b", 2}},
+      /* stop_eos = */ true,
+      /* stop_str = */ {},
+      /* loop_after_dispatch = */ true,
+      /* excluded_str = */ {"Z"}
+  };
+  auto fsm_result = GrammarFSMBuilder::TagDispatch(tag_dispatch);
+  EXPECT_TRUE(fsm_result.has_value());
+  auto fsm = std::move(fsm_result).value();
+  auto fsm_printed = fsm.ToString();
+  std::string expected_fsm_printed = R"(FSM(num_states=6, start=0, end=[0, 1, 2], edges=[
+0: [[\0-Y]->0, [[-`]->0, 'a'->1, 'b'->4, [c-\xff]->0]
+1: [[\0-Y]->0, [[-`]->0, 'a'->1, 'b'->4, [c-\xff]->0]
+4: [Rule(2)->0]
+]))";
+
+  EXPECT_EQ(fsm_printed, expected_fsm_printed);
+}
+
+TEST(XGrammarFSMBuilderTest, TestTagDispatchFSMBuilder6) {
+  // Case 6. A trigger overlapping the excluded strings. "bc" is a suffix of the trigger "abc",
+  // which is matched as the trigger, while "bd" is excluded after "ab".
+  Grammar::Impl::TagDispatch tag_dispatch = {
+      /* tag_rule_pairs = */ {{"abc", 1}},
+      /* stop_eos = */ true,
+      /* stop_str = */ {},
+      /* loop_after_dispatch = */ true,
+      /* excluded_str = */ {"bc", "bd"}
+  };
+  auto fsm_result = GrammarFSMBuilder::TagDispatch(tag_dispatch);
+  EXPECT_TRUE(fsm_result.has_value());
+  auto fsm = std::move(fsm_result).value();
+  auto fsm_printed = fsm.ToString();
+  std::string expected_fsm_printed = R"(FSM(num_states=7, start=0, end=[0, 1, 2, 4], edges=[
+0: [[\0-`]->0, 'a'->1, 'b'->4, [c-\xff]->0]
+1: [[\0-`]->0, 'a'->1, 'b'->2, [c-\xff]->0]
+2: [[\0-`]->0, 'a'->1, 'b'->4, 'c'->3, [e-\xff]->0]
+3: [Rule(1)->0]
+4: [[\0-`]->0, 'a'->1, 'b'->4, [e-\xff]->0]
+]))";
+
+  EXPECT_EQ(fsm_printed, expected_fsm_printed);
+}
+
 using GrammarExpr = Grammar::Impl::GrammarExpr;
 using GrammarExprType = Grammar::Impl::GrammarExprType;
 
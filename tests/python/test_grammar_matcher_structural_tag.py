@@ -1,211 +1,161 @@
+import functools
 import json
 import sys
-import threading
-import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Tuple
 
 import pytest
+import torch
 from pydantic import BaseModel
-from transformers import AutoTokenizer
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
 
 import xgrammar as xgr
-from xgrammar.testing import _get_masked_tokens_from_bitmask, _is_grammar_accept_string
+from xgrammar.testing import (
+    _are_grammar_accept_strings,
+    _fill_next_token_bitmask_for_prefixes,
+    _get_masked_tokens_from_bitmask,
+    _is_grammar_accept_string,
+)
 
 
-def test_utf8():
-    # Test utf8-encoded string with structural tags
-    class Schema(BaseModel):
-        arg1: str
-        arg2: int
+@pytest.fixture(scope="module")
+def llama31_tokenizer_info() -> Tuple[PreTrainedTokenizerBase, xgr.TokenizerInfo]:
+    """The Llama-3.1 huggingface tokenizer and its XGrammar tokenizer info."""
+    tokenizer_id = "meta-llama/Llama-3.1-8B-Instruct"
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_id, use_fast=True, trust_remote_code=True)
+    return tokenizer, xgr.TokenizerInfo.from_huggingface(tokenizer)
+
+
+@pytest.fixture(scope="module")
+def llama31_compiler(
+    llama31_tokenizer_info: Tuple[PreTrainedTokenizerBase, xgr.TokenizerInfo]
+) -> xgr.GrammarCompiler:
+    """A grammar compiler for the Llama-3.1 tokenizer shared across the module. The compiler is
+    thread-safe, so its caches can be kept warm between tests."""
+    return xgr.GrammarCompiler(llama31_tokenizer_info[1])
+
+
+@pytest.fixture(scope="module")
+def llama31_single_thread_compiler(
+    llama31_tokenizer_info: Tuple[PreTrainedTokenizerBase, xgr.TokenizerInfo]
+) -> xgr.GrammarCompiler:
+    """A grammar compiler for the Llama-3.1 tokenizer that compiles with a single thread."""
+    return xgr.GrammarCompiler(llama31_tokenizer_info[1], max_threads=1)
+
+
+@pytest.fixture(scope="module")
+def _token_bitmask_buffer(
+    llama31_tokenizer_info: Tuple[PreTrainedTokenizerBase, xgr.TokenizerInfo]
+) -> torch.Tensor:
+    return xgr.allocate_token_bitmask(1, llama31_tokenizer_info[1].vocab_size)
+
+
+@pytest.fixture
+def token_bitmask(_token_bitmask_buffer: torch.Tensor) -> torch.Tensor:
+    """A token bitmask shared across the module. It is reset to the full mask in place before
+    each test instead of being reallocated."""
+    xgr.reset_token_bitmask(_token_bitmask_buffer)
+    return _token_bitmask_buffer
+
+
+class Schema1(BaseModel):
+    arg1: str
+    arg2: int
+
+
+class Schema2(BaseModel):
+    arg3: float
+    arg4: List[str]
 
-    tags = [
-        xgr.StructuralTagItem(begin="，，", schema=Schema, end="。"),
-        xgr.StructuralTagItem(begin="，！", schema=Schema, end="。。"),
-        xgr.StructuralTagItem(begin="，，？", schema=Schema, end="。。。"),
-        xgr.StructuralTagItem(begin="｜｜？", schema=Schema, end="｜？｜"),
-    ]
-    triggers = ["，", "｜｜"]
 
-    grammar = xgr.Grammar.from_structural_tag(tags, triggers)
+# The serialized schemas are pure functions of the models, so compute them once.
+SCHEMA1_JSON = json.dumps(Schema1.model_json_schema())
+SCHEMA2_JSON = json.dumps(Schema2.model_json_schema())
 
-    accepted_inputs = [
+# The grammars are immutable, so parse the start grammar of the pressure test once.
+START_GRAMMAR = xgr.Grammar.from_ebnf("root ::= [a-z] root | [a-z]")
+
+
+@functools.lru_cache(maxsize=256)
+def _stag_item(begin: str, schema_json: str, end: str) -> xgr.StructuralTagItem:
+    """Build a structural tag item once per (begin, schema, end) triple. The schema is passed as
+    a JSON string so that the key is hashable."""
+    return xgr.StructuralTagItem(begin=begin, schema=schema_json, end=end)
+
+
+# Encoded once at import so the matcher receives the UTF-8 bytes directly.
+utf8_accepted_inputs = [
+    s.encode("utf-8")
+    for s in [
         '这是无用的内容，，{"arg1": "你好，世界！", "arg2": 0}。这是无用的内容',
         '这是无用的内容，！{"arg1": "こんにちは！", "arg2": 1}。。这是无用的内容',
         '这是无用的内容，，？{"arg1": "안녕하세요！", "arg2": 2}。。。这是无用的内容，！{"arg1": "안녕하세요！", "arg2": 3}。。',
         '这是无用的内容｜｜？{"arg1": "။စ်န, ်ပြ！", "arg2": 0}｜？｜｜｜？{"arg1": "။စ်န, ်ပြ", "arg2": 0}｜？｜',
     ]
-    for input_str in accepted_inputs:
-        assert _is_grammar_accept_string(grammar, input_str, print_time=True)
-
-
-expected_grammar_test_structural_tag_after_optimization = r"""basic_escape ::= (([\"\\/bfnrt]) | ("u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9])) (=(basic_string_sub))
-basic_string_sub ::= (("\"") | ([^\0-\x1f\"\\\r\n] basic_string_sub) | ("\\" basic_escape basic_string_sub)) (=([ \n\t]* [,}\]:]))
-basic_integer ::= (("0") | (basic_integer_1 [1-9] [0-9]*))
-basic_string ::= (("\"" basic_string_sub)) (=(root_part_0 [ \n\t]* "}"))
-root_part_0 ::= (([ \n\t]* "," [ \n\t]* "\"arg2\"" [ \n\t]* ":" [ \n\t]* basic_integer)) (=([ \n\t]* "}"))
-root_0 ::= (("{" [ \n\t]* "\"arg1\"" [ \n\t]* ":" [ \n\t]* basic_string root_part_0 [ \n\t]* "}")) (=("</function>"))
-basic_integer_1 ::= ("" | ("-")) (=([1-9] [0-9]*))
-basic_escape_1 ::= (([\"\\/bfnrt]) | ("u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9])) (=(basic_string_sub_1))
-basic_string_sub_1 ::= (("\"") | ([^\0-\x1f\"\\\r\n] basic_string_sub_1) | ("\\" basic_escape_1 basic_string_sub_1)) (=([ \n\t]* [,}\]:]))
-basic_integer_2 ::= (("0") | (basic_integer_1_1 [1-9] [0-9]*))
-basic_string_1 ::= (("\"" basic_string_sub_1)) (=(root_part_0_1 [ \n\t]* "}"))
-root_part_0_1 ::= (([ \n\t]* "," [ \n\t]* "\"arg2\"" [ \n\t]* ":" [ \n\t]* basic_integer_2)) (=([ \n\t]* "}"))
-root_1 ::= (("{" [ \n\t]* "\"arg1\"" [ \n\t]* ":" [ \n\t]* basic_string_1 root_part_0_1 [ \n\t]* "}")) (=("</function>"))
-basic_integer_1_1 ::= ("" | ("-")) (=([1-9] [0-9]*))
-basic_escape_2 ::= (([\"\\/bfnrt]) | ("u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9])) (=(basic_string_sub_2))
-basic_string_sub_2 ::= (("\"") | ([^\0-\x1f\"\\\r\n] basic_string_sub_2) | ("\\" basic_escape_2 basic_string_sub_2)) (=([ \n\t]* [,}\]:]))
-basic_number_9 ::= ((basic_number_1_2 basic_number_7_2 basic_number_3_2 basic_number_6_2)) (=(root_part_0_2 [ \n\t]* "}"))
-basic_string_2 ::= (("\"" basic_string_sub_2))
-root_prop_1 ::= (("[" [ \n\t]* basic_string_2 root_prop_1_1 [ \n\t]* "]") | ("[" [ \n\t]* "]"))
-root_part_0_2 ::= (([ \n\t]* "," [ \n\t]* "\"arg4\"" [ \n\t]* ":" [ \n\t]* root_prop_1)) (=([ \n\t]* "}"))
-root_2 ::= (("{" [ \n\t]* "\"arg3\"" [ \n\t]* ":" [ \n\t]* basic_number_9 root_part_0_2 [ \n\t]* "}")) (=("</function>"))
-basic_number_1_2 ::= ("" | ("-")) (=(basic_number_7_2 basic_number_3_2 basic_number_6_2))
-basic_number_2_2 ::= (([0-9] basic_number_2_2) | ([0-9]))
-basic_number_3_2 ::= ("" | ("." basic_number_2_2)) (=(basic_number_6_2))
-basic_number_4_2 ::= ("" | ([+\-])) (=(basic_number_5_2))
-basic_number_5_2 ::= (([0-9] basic_number_5_2) | ([0-9]))
-basic_number_6_2 ::= ("" | ([eE] basic_number_4_2 basic_number_5_2))
-root_prop_1_1 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_string_2 root_prop_1_1)) (=([ \n\t]* "]"))
-basic_number_7_2 ::= (("0") | ([1-9] [0-9]*)) (=(basic_number_3_2 basic_number_6_2))
-triggered_tags_group ::= (("1>" root_0 "</function>") | ("2>" root_1 "</function>"))
-triggered_tags_group_1 ::= ((">" root_2 "</function>"))
-triggered_tags ::= TagDispatch(
-  ("<function=f", triggered_tags_group),
-  ("<function=g", triggered_tags_group_1),
-  stop_eos=true,
-  stop_str=(),
-  loop_after_dispatch=true,
-  excludes=()
-)
-root ::= ((triggered_tags))
-"""
+]
 
-expected_grammar_test_structural_tag_before_optimization = r"""basic_escape ::= (([\"\\/bfnrt]) | ("u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]))
-basic_string_sub ::= (("\"") | ([^\0-\x1f\"\\\r\n] basic_string_sub) | ("\\" basic_escape basic_string_sub)) (=([ \n\t]* [,}\]:]))
-basic_any ::= ((basic_number) | (basic_string) | (basic_boolean) | (basic_null) | (basic_array) | (basic_object))
-basic_integer ::= (("0") | (basic_integer_1 [1-9] [0-9]*))
-basic_number ::= ((basic_number_1 basic_number_7 basic_number_3 basic_number_6))
-basic_string ::= (("\"" basic_string_sub))
-basic_boolean ::= (("true") | ("false"))
-basic_null ::= (("null"))
-basic_array ::= (("[" [ \n\t]* basic_any basic_array_1 [ \n\t]* "]") | ("[" [ \n\t]* "]"))
-basic_object ::= (("{" [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_any basic_object_1 [ \n\t]* "}") | ("{" [ \n\t]* "}"))
-root_part_0 ::= (([ \n\t]* "," [ \n\t]* "\"arg2\"" [ \n\t]* ":" [ \n\t]* basic_integer))
-root_0 ::= (("{" [ \n\t]* "\"arg1\"" [ \n\t]* ":" [ \n\t]* basic_string root_part_0 [ \n\t]* "}"))
-basic_integer_1 ::= ("" | ("-"))
-basic_number_1 ::= ("" | ("-"))
-basic_number_2 ::= (([0-9] basic_number_2) | ([0-9]))
-basic_number_3 ::= ("" | ("." basic_number_2))
-basic_number_4 ::= ("" | ([+\-]))
-basic_number_5 ::= (([0-9] basic_number_5) | ([0-9]))
-basic_number_6 ::= ("" | ([eE] basic_number_4 basic_number_5))
-basic_array_1 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_any basic_array_1))
-basic_object_1 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_string [ \n\t]* ":" [ \n\t]* basic_any basic_object_1))
-basic_number_7 ::= (("0") | ([1-9] [0-9]*))
-basic_escape_1 ::= (([\"\\/bfnrt]) | ("u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]))
-basic_string_sub_1 ::= (("\"") | ([^\0-\x1f\"\\\r\n] basic_string_sub_1) | ("\\" basic_escape_1 basic_string_sub_1)) (=([ \n\t]* [,}\]:]))
-basic_any_1 ::= ((basic_number_8) | (basic_string_1) | (basic_boolean_1) | (basic_null_1) | (basic_array_2) | (basic_object_2))
-basic_integer_2 ::= (("0") | (basic_integer_1_1 [1-9] [0-9]*))
-basic_number_8 ::= ((basic_number_1_1 basic_number_7_1 basic_number_3_1 basic_number_6_1))
-basic_string_1 ::= (("\"" basic_string_sub_1))
-basic_boolean_1 ::= (("true") | ("false"))
-basic_null_1 ::= (("null"))
-basic_array_2 ::= (("[" [ \n\t]* basic_any_1 basic_array_1_1 [ \n\t]* "]") | ("[" [ \n\t]* "]"))
-basic_object_2 ::= (("{" [ \n\t]* basic_string_1 [ \n\t]* ":" [ \n\t]* basic_any_1 basic_object_1_1 [ \n\t]* "}") | ("{" [ \n\t]* "}"))
-root_part_0_1 ::= (([ \n\t]* "," [ \n\t]* "\"arg2\"" [ \n\t]* ":" [ \n\t]* basic_integer_2))
-root_1 ::= (("{" [ \n\t]* "\"arg1\"" [ \n\t]* ":" [ \n\t]* basic_string_1 root_part_0_1 [ \n\t]* "}"))
-basic_integer_1_1 ::= ("" | ("-"))
-basic_number_1_1 ::= ("" | ("-"))
-basic_number_2_1 ::= (([0-9] basic_number_2_1) | ([0-9]))
-basic_number_3_1 ::= ("" | ("." basic_number_2_1))
-basic_number_4_1 ::= ("" | ([+\-]))
-basic_number_5_1 ::= (([0-9] basic_number_5_1) | ([0-9]))
-basic_number_6_1 ::= ("" | ([eE] basic_number_4_1 basic_number_5_1))
-basic_array_1_1 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_any_1 basic_array_1_1))
-basic_object_1_1 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_string_1 [ \n\t]* ":" [ \n\t]* basic_any_1 basic_object_1_1))
-basic_number_7_1 ::= (("0") | ([1-9] [0-9]*))
-basic_escape_2 ::= (([\"\\/bfnrt]) | ("u" [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9] [A-Fa-f0-9]))
-basic_string_sub_2 ::= (("\"") | ([^\0-\x1f\"\\\r\n] basic_string_sub_2) | ("\\" basic_escape_2 basic_string_sub_2)) (=([ \n\t]* [,}\]:]))
-basic_any_2 ::= ((basic_number_9) | (basic_string_2) | (basic_boolean_2) | (basic_null_2) | (basic_array_3) | (basic_object_3))
-basic_integer_3 ::= (("0") | (basic_integer_1_2 [1-9] [0-9]*))
-basic_number_9 ::= ((basic_number_1_2 basic_number_7_2 basic_number_3_2 basic_number_6_2))
-basic_string_2 ::= (("\"" basic_string_sub_2))
-basic_boolean_2 ::= (("true") | ("false"))
-basic_null_2 ::= (("null"))
-basic_array_3 ::= (("[" [ \n\t]* basic_any_2 basic_array_1_2 [ \n\t]* "]") | ("[" [ \n\t]* "]"))
-basic_object_3 ::= (("{" [ \n\t]* basic_string_2 [ \n\t]* ":" [ \n\t]* basic_any_2 basic_object_1_2 [ \n\t]* "}") | ("{" [ \n\t]* "}"))
-root_prop_1 ::= (("[" [ \n\t]* basic_string_2 root_prop_1_1 [ \n\t]* "]") | ("[" [ \n\t]* "]"))
-root_part_0_2 ::= (([ \n\t]* "," [ \n\t]* "\"arg4\"" [ \n\t]* ":" [ \n\t]* root_prop_1))
-root_2 ::= (("{" [ \n\t]* "\"arg3\"" [ \n\t]* ":" [ \n\t]* basic_number_9 root_part_0_2 [ \n\t]* "}"))
-basic_integer_1_2 ::= ("" | ("-"))
-basic_number_1_2 ::= ("" | ("-"))
-basic_number_2_2 ::= (([0-9] basic_number_2_2) | ([0-9]))
-basic_number_3_2 ::= ("" | ("." basic_number_2_2))
-basic_number_4_2 ::= ("" | ([+\-]))
-basic_number_5_2 ::= (([0-9] basic_number_5_2) | ([0-9]))
-basic_number_6_2 ::= ("" | ([eE] basic_number_4_2 basic_number_5_2))
-basic_array_1_2 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_any_2 basic_array_1_2))
-basic_object_1_2 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_string_2 [ \n\t]* ":" [ \n\t]* basic_any_2 basic_object_1_2))
-root_prop_1_1 ::= ("" | ([ \n\t]* "," [ \n\t]* basic_string_2 root_prop_1_1))
-basic_number_7_2 ::= (("0") | ([1-9] [0-9]*))
-triggered_tags_group ::= (("1>" root_0 "</function>") | ("2>" root_1 "</function>"))
-triggered_tags_group_1 ::= ((">" root_2 "</function>"))
-triggered_tags ::= TagDispatch(
-  ("<function=f", triggered_tags_group),
-  ("<function=g", triggered_tags_group_1),
-  stop_eos=true,
-  stop_str=(),
-  loop_after_dispatch=true,
-  excludes=()
-)
-root ::= ((triggered_tags))
-"""
 
+@pytest.fixture(scope="module")
+def utf8_stag_grammar() -> xgr.Grammar:
+    tags = [
+        _stag_item("，，", SCHEMA1_JSON, "。"),
+        _stag_item("，！", SCHEMA1_JSON, "。。"),
+        _stag_item("，，？", SCHEMA1_JSON, "。。。"),
+        _stag_item("｜｜？", SCHEMA1_JSON, "｜？｜"),
+    ]
+    triggers = ["，", "｜｜"]
+    return xgr.Grammar.from_structural_tag(tags, triggers)
 
-def test_structural_tag():
-    class Schema1(BaseModel):
-        arg1: str
-        arg2: int
 
-    class Schema2(BaseModel):
-        arg3: float
-        arg4: List[str]
+@pytest.mark.parametrize("input_str", utf8_accepted_inputs)
+def test_utf8(utf8_stag_grammar: xgr.Grammar, input_str: bytes):
+    # Test utf8-encoded string with structural tags
+    assert _is_grammar_accept_string(utf8_stag_grammar, input_str)
 
+
+@functools.lru_cache(maxsize=None)
+def _expected_grammar(name: str) -> str:
+    """Read an expected grammar from the data directory. It is only loaded by the tests that
+    compare against it."""
+    return (Path(__file__).parent / "data" / name).read_text(encoding="utf-8")
+
+
+@pytest.fixture(scope="module")
+def stag_grammar() -> xgr.Grammar:
     tags = [
-        xgr.StructuralTagItem(begin="<function=f1>", schema=Schema1, end="</function>"),
-        xgr.StructuralTagItem(begin="<function=f2>", schema=Schema1, end="</function>"),
-        xgr.StructuralTagItem(begin="<function=g>", schema=Schema2, end="</function>"),
+        _stag_item("<function=f1>", SCHEMA1_JSON, "</function>"),
+        _stag_item("<function=f2>", SCHEMA1_JSON, "</function>"),
+        _stag_item("<function=g>", SCHEMA2_JSON, "</function>"),
     ]
     # in real cases, we should use one trigger: "<function=" and dispatch to two tags
     # but here we use two triggers for testing such cases
     triggers = ["<function=f", "<function=g"]
+    return xgr.Grammar.from_structural_tag(tags, triggers)
 
-    grammar = xgr.Grammar.from_structural_tag(tags, triggers)
-    assert str(grammar) == expected_grammar_test_structural_tag_before_optimization
 
-    accepted_inputs = [
-        '<function=f1>{"arg1": "abc", "arg2": 1}</function>',
-        '<function=g>{"arg3": 1.23, "arg4": ["a", "b", "c"]}</function>',
-        '<function=f2>{"arg1": "abc", "arg2": 1}</function><function=g>{"arg3": 1.23, "arg4": ["a", "b", "c"]}</function>',
-        'hhhh<function=g>{"arg3": 1.23, "arg4": ["a", "b", "c"]}</function>haha<function=f1>{"arg1": "abc", "arg2": 1}</function>123',
-    ]
-    for input in accepted_inputs:
-        assert _is_grammar_accept_string(grammar, input, print_time=True)
+def test_structural_tag(stag_grammar: xgr.Grammar):
+    assert str(stag_grammar) == _expected_grammar("stag_expected_pre.ebnf")
 
 
-def test_structural_tag_compiler():
-    class Schema1(BaseModel):
-        arg1: str
-        arg2: int
+structural_tag_accepted_inputs = [
+    '<function=f1>{"arg1": "abc", "arg2": 1}</function>',
+    '<function=g>{"arg3": 1.23, "arg4": ["a", "b", "c"]}</function>',
+    '<function=f2>{"arg1": "abc", "arg2": 1}</function><function=g>{"arg3": 1.23, "arg4": ["a", "b", "c"]}</function>',
+    'hhhh<function=g>{"arg3": 1.23, "arg4": ["a", "b", "c"]}</function>haha<function=f1>{"arg1": "abc", "arg2": 1}</function>123',
+]
 
-    class Schema2(BaseModel):
-        arg3: float
-        arg4: List[str]
 
+@pytest.mark.parametrize("input_str", structural_tag_accepted_inputs)
+def test_structural_tag_accepted(stag_grammar: xgr.Grammar, input_str: str):
+    assert _is_grammar_accept_string(stag_grammar, input_str)
+
+
+def test_structural_tag_compiler():
     tags = [
-        xgr.StructuralTagItem(begin="<function=f1>", schema=Schema1, end="</function>"),
-        xgr.StructuralTagItem(begin="<function=f2>", schema=Schema1, end="</function>"),
-        xgr.StructuralTagItem(begin="<function=g>", schema=Schema2, end="</function>"),
+        _stag_item("<function=f1>", SCHEMA1_JSON, "</function>"),
+        _stag_item("<function=f2>", SCHEMA1_JSON, "</function>"),
+        _stag_item("<function=g>", SCHEMA2_JSON, "</function>"),
     ]
 
     # in real cases, we should use one trigger: "<function=" and dispatch to two tags
@@ -214,43 +164,29 @@ def test_structural_tag_compiler():
 
     compiler = xgr.GrammarCompiler(xgr.TokenizerInfo([]))
     compiled_grammar = compiler.compile_structural_tag(tags, triggers)
-    assert str(compiled_grammar.grammar) == expected_grammar_test_structural_tag_after_optimization
+    assert str(compiled_grammar.grammar) == _expected_grammar("stag_expected_post.ebnf")
 
 
 @pytest.mark.hf_token_required
-def test_structural_tag_mask_gen():
-    # Define schemas for the test
-    class Schema1(BaseModel):
-        arg1: str
-        arg2: int
-
-    class Schema2(BaseModel):
-        arg3: float
-        arg4: List[str]
-
+@pytest.mark.parametrize("for_prefixes", [False, True], ids=["per_step", "for_prefixes"])
+def test_structural_tag_mask_gen(
+    llama31_tokenizer_info: Tuple[PreTrainedTokenizerBase, xgr.TokenizerInfo],
+    llama31_compiler: xgr.GrammarCompiler,
+    token_bitmask: torch.Tensor,
+    for_prefixes: bool,
+):
     # Set up grammar from schemas
     tags = [
-        xgr.StructuralTagItem(
-            begin="<function=f>", schema=json.dumps(Schema1.model_json_schema()), end="</function>"
-        ),
-        xgr.StructuralTagItem(
-            begin="<function=g>", schema=json.dumps(Schema2.model_json_schema()), end="</function>"
-        ),
+        _stag_item("<function=f>", SCHEMA1_JSON, "</function>"),
+        _stag_item("<function=g>", SCHEMA2_JSON, "</function>"),
     ]
     triggers = ["<function=f", "<function=g"]
 
-    # Set up tokenizer
-    tokenizer_id = "meta-llama/Llama-3.1-8B-Instruct"
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_id, use_fast=True, trust_remote_code=True)
-    tokenizer_info = xgr.TokenizerInfo.from_huggingface(tokenizer)
+    tokenizer, tokenizer_info = llama31_tokenizer_info
 
     # Compile grammar and create matcher
-    compiler = xgr.GrammarCompiler(tokenizer_info)
-    time_start = time.monotonic_ns()
-    compiled_grammar = compiler.compile_structural_tag(tags, triggers)
+    compiled_grammar = llama31_compiler.compile_structural_tag(tags, triggers)
     matcher = xgr.GrammarMatcher(compiled_grammar)
-    time_end = time.monotonic_ns()
-    print(f"Time to compile grammar and init GrammarMatcher: {(time_end - time_start) / 1e3} us")
 
     # Test input string
     accepted_input = (
@@ -265,43 +201,61 @@ def test_structural_tag_mask_gen():
     ]
     input_bytes = accepted_input.encode("utf-8")
 
-    # Set up token bitmask for validation
-    token_bitmask = xgr.allocate_token_bitmask(1, tokenizer_info.vocab_size)
+    if for_prefixes:
+        # Fill the bitmask of every prefix and accept the input in a single call
+        prefix_bitmasks = xgr.allocate_token_bitmask(len(input_bytes), tokenizer_info.vocab_size)
+        need_apply_list = _fill_next_token_bitmask_for_prefixes(
+            matcher, input_bytes, prefix_bitmasks
+        )
+        assert len(need_apply_list) == len(input_bytes)
 
     # Process input character by character
     for i, c in enumerate(input_bytes):
         # 1. Test token bitmask generation
-        time_start = time.monotonic_ns()
-        need_apply = matcher.fill_next_token_bitmask(token_bitmask)
-        time_end = time.monotonic_ns()
-        print(f"Time to fill_next_token_bitmask: {(time_end - time_start) / 1e3} us")
+        if for_prefixes:
+            need_apply = need_apply_list[i]
+            bitmask, index = prefix_bitmasks, i
+        else:
+            need_apply = matcher.fill_next_token_bitmask(token_bitmask)
+            bitmask, index = token_bitmask, 0
         assert need_apply == (i not in dont_apply_mask_indices)
 
         # 2. Verify token bitmask correctness
         rejected_token_ids = _get_masked_tokens_from_bitmask(
-            token_bitmask, tokenizer_info.vocab_size
+            bitmask, tokenizer_info.vocab_size, index
         )
         # This checking does not support non-ascii characters for now
         token_id_for_next_char = tokenizer.convert_tokens_to_ids(chr(c))
         assert token_id_for_next_char not in rejected_token_ids
 
         # 3. Test character acceptance
-        print("Accepting char:", bytes([c]))
-        time_start = time.monotonic_ns()
-        assert matcher.accept_string(bytes([c]))
-        time_end = time.monotonic_ns()
-        print(f"Time to accept_token: {(time_end - time_start) / 1e3} us")
+        if not for_prefixes:
+            assert matcher.accept_string(bytes([c]))
 
     # Final verification - check that EOS token is allowed
-    time_start = time.monotonic_ns()
     need_apply = matcher.fill_next_token_bitmask(token_bitmask)
-    time_end = time.monotonic_ns()
     assert need_apply == (len(input_bytes) not in dont_apply_mask_indices)
-    print(f"Time to fill_next_token_bitmask: {(time_end - time_start) / 1e3} us")
     rejected_token_ids = _get_masked_tokens_from_bitmask(token_bitmask, tokenizer_info.vocab_size)
     assert tokenizer.eos_token_id not in rejected_token_ids
 
 
+@pytest.mark.hf_token_required
+def test_structural_tag_mask_gen_bench(
+    benchmark, llama31_compiler: xgr.GrammarCompiler, token_bitmask: torch.Tensor
+):
+    tags = [
+        _stag_item("<function=f>", SCHEMA1_JSON, "</function>"),
+        _stag_item("<function=g>", SCHEMA2_JSON, "</function>"),
+    ]
+    triggers = ["<function=f", "<function=g"]
+    compiled_grammar = llama31_compiler.compile_structural_tag(tags, triggers)
+    matcher = xgr.GrammarMatcher(compiled_grammar)
+    assert matcher.accept_string('hhhh<function=g>{"arg3": 1.23, "arg4": ["a", "b", "c"]}')
+
+    # fill_next_token_bitmask does not change the matcher state, so it can be run repeatedly
+    benchmark(matcher.fill_next_token_bitmask, token_bitmask)
+
+
 def test_empty_tag_dispatch():
     grammar_str = """root ::= TagDispatch(
   stop_eos=true,
@@ -310,9 +264,7 @@ def test_empty_tag_dispatch():
 )
 """
     grammar = xgr.Grammar.from_ebnf(grammar_str)
-    assert _is_grammar_accept_string(grammar, "any string")
-    assert _is_grammar_accept_string(grammar, "")
-    assert _is_grammar_accept_string(grammar, "好")
+    assert _are_grammar_accept_strings(grammar, ["any string", "", "好"]) == [True] * 3
 
     grammar_with_stop_str_str = """root ::= TagDispatch(
   stop_eos=false,
@@ -330,6 +282,24 @@ def test_empty_tag_dispatch():
     assert not _is_grammar_accept_string(grammar_with_stop_str, "aaa")
 
 
+def test_tag_dispatch_overlapping_triggers():
+    grammar_str = """root ::= TagDispatch(
+  ("abc", rule1),
+  ("b", rule2),
+  stop_eos=true,
+  stop_str=(),
+  loop_after_dispatch=true,
+  excludes=("Z")
+)
+rule1 ::= "Y"
+rule2 ::= "Z"
+"""
+    grammar = xgr.Grammar.from_ebnf(grammar_str)
+    # "b" is matched inside "abc" before "abc" is complete, so it dispatches to rule2.
+    instances = ["bZ", "xbZ", "abZ", "aabZ", "ab", "abcY"]
+    assert _are_grammar_accept_strings(grammar, instances) == [True, True, True, True, False, False]
+
+
 @pytest.mark.hf_token_required
 def test_utf8_structural_tag_begin_end():
     model = "deepseek-ai/DeepSeek-V3-0324"
@@ -344,34 +314,30 @@ def test_utf8_structural_tag_begin_end():
 
 
 @pytest.mark.hf_token_required
-def test_pressure_structural_tag():
-    model = "meta-llama/Llama-3.1-8B-Instruct"
-    tokenizer = AutoTokenizer.from_pretrained(model, use_fast=True, trust_remote_code=True)
-    tokenizer_info = xgr.TokenizerInfo.from_huggingface(tokenizer)
-    compiler = xgr.GrammarCompiler(tokenizer_info, max_threads=1)
-    threads = []
+def test_pressure_structural_tag(llama31_single_thread_compiler: xgr.GrammarCompiler):
     start = "start"
     schema = {"type": "object", "properties": {"arg": {"type": "string"}}}
+    schema_json = json.dumps(schema, sort_keys=True)
     end = "end"
 
-    def worker(idx: int):
-        tag = xgr.StructuralTagItem(begin=start, schema=schema, end=end)
+    # Sample the concat depths in [0, 128) geometrically, plus the values near the upper end.
+    # Larger depths cover the code paths of the smaller ones, so a linear sweep is not needed.
+    concat_depths = [0, 1, 2, 4, 8, 16, 32, 64, 96, 127]
+
+    def worker(depth: int):
+        tag = _stag_item(start, schema_json, end)
         triggers = [start]
         stag_grammar = xgr.Grammar.from_structural_tag([tag], triggers)
-        start_grammar = xgr.Grammar.from_ebnf("root ::= [a-z] root | [a-z]")
-        grammar = start_grammar
-        for _ in range(idx):
-            grammar = grammar.concat(grammar, start_grammar)
+        grammar = START_GRAMMAR
+        for _ in range(depth):
+            grammar = grammar.concat(grammar, START_GRAMMAR)
         final_grammar = xgr.Grammar.concat(grammar, stag_grammar)
-        _ = compiler.compile_grammar(final_grammar)
-
-    for i in range(128):
-        t = threading.Thread(target=worker, args=(i,))
-        threads.append(t)
-        t.start()
+        _ = llama31_single_thread_compiler.compile_grammar(final_grammar)
 
-    for t in threads:
-        t.join()
+    # The workers compile concurrently with the shared compiler, which is what the test stresses.
+    # Collecting the results re-raises any error from the workers.
+    with ThreadPoolExecutor(max_workers=len(concat_depths)) as executor:
+        list(executor.map(worker, concat_depths))
 
 
 if __name__ == "__main__":
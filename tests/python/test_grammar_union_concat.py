@@ -6,29 +6,32 @@ import pytest
 
 import xgrammar as xgr
 
-
-def test_grammar_union():
-    grammar1 = xgr.Grammar.from_ebnf(
-        """root ::= r1 | r2
+# The grammars are immutable, so parse them once and share them between the tests.
+GRAMMAR1 = xgr.Grammar.from_ebnf(
+    """root ::= r1 | r2
 r1 ::= "true" | ""
 r2 ::= "false" | ""
 """
-    )
+)
 
-    grammar2 = xgr.Grammar.from_ebnf(
-        """root ::= "abc" | r1
+GRAMMAR2 = xgr.Grammar.from_ebnf(
+    """root ::= "abc" | r1
 r1 ::= "true" | r1
 """
-    )
+)
 
-    grammar3 = xgr.Grammar.from_ebnf(
-        """root ::= r1 | r2 | r3
+GRAMMAR3 = xgr.Grammar.from_ebnf(
+    """root ::= r1 | r2 | r3
 r1 ::= "true" | r3
 r2 ::= "false" | r3
 r3 ::= "abc" | ""
 """
-    )
+)
 
+START_GRAMMAR = xgr.Grammar.from_ebnf("root ::= [a-z] root | [a-z]")
+
+
+def test_grammar_union():
     expected = """root ::= ((root_1) | (root_2) | (root_3))
 root_1 ::= ((r1) | (r2))
 r1 ::= ("" | ("true"))
@@ -41,32 +44,11 @@ r2_1 ::= (("false") | (r3))
 r3 ::= ("" | ("abc"))
 """
 
-    union_grammar = xgr.Grammar.union(grammar1, grammar2, grammar3)
+    union_grammar = xgr.Grammar.union(GRAMMAR1, GRAMMAR2, GRAMMAR3)
     assert str(union_grammar) == expected
 
 
 def test_grammar_concat():
-    grammar1 = xgr.Grammar.from_ebnf(
-        """root ::= r1 | r2
-r1 ::= "true" | ""
-r2 ::= "false" | ""
-"""
-    )
-
-    grammar2 = xgr.Grammar.from_ebnf(
-        """root ::= "abc" | r1
-r1 ::= "true" | r1
-"""
-    )
-
-    grammar3 = xgr.Grammar.from_ebnf(
-        """root ::= r1 | r2 | r3
-r1 ::= "true" | r3
-r2 ::= "false" | r3
-r3 ::= "abc" | ""
-"""
-    )
-
     expected = """root ::= ((root_1 root_2 root_3))
 root_1 ::= ((r1) | (r2))
 r1 ::= ("" | ("true"))
@@ -79,7 +61,7 @@ r2_1 ::= (("false") | (r3))
 r3 ::= ("" | ("abc"))
 """
 
-    concat_grammar = xgr.Grammar.concat(grammar1, grammar2, grammar3)
+    concat_grammar = xgr.Grammar.concat(GRAMMAR1, GRAMMAR2, GRAMMAR3)
     assert str(concat_grammar) == expected
 
 
@@ -157,10 +139,9 @@ root_2 ::= (([a-z] root_2) | ([a-z]))
     tag = xgr.StructuralTagItem(begin=start, schema=schema, end=end)
     triggers = [start]
     stag_grammar = xgr.Grammar.from_structural_tag([tag], triggers)
-    start_grammar = xgr.Grammar.from_ebnf("root ::= [a-z] root | [a-z]")
-    grammar_union = xgr.Grammar.union(stag_grammar, start_grammar)
+    grammar_union = xgr.Grammar.union(stag_grammar, START_GRAMMAR)
     assert str(grammar_union) == expected_grammar_union
-    grammar_concat = xgr.Grammar.concat(stag_grammar, start_grammar)
+    grammar_concat = xgr.Grammar.concat(stag_grammar, START_GRAMMAR)
     assert str(grammar_concat) == expected_grammar_concat
 
 
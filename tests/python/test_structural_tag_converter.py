@@ -1,51 +1,114 @@
+import difflib
+import functools
+import json
 import sys
+import threading
 import time
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import pytest
+import torch
 from transformers import AutoTokenizer
 
 import xgrammar as xgr
 from xgrammar.structural_tag import StructuralTag
-from xgrammar.testing import _is_grammar_accept_string
+from xgrammar.testing import (
+    _are_grammar_accept_strings,
+    _fill_next_token_bitmask_for_prefixes,
+    _is_grammar_accept_string,
+)
+
+# Keep the module on one worker under `pytest -n auto --dist=loadgroup`, so the profiler compiles
+# each structural tag once.
+pytestmark = pytest.mark.xdist_group("structural_tag")
+
+
+@functools.singledispatch
+def _get_structural_tag_json(structural_tag_format: Dict[str, Any]) -> str:
+    """Wrap a structural tag format into a structural tag and serialize it. A StructuralTag is
+    serialized as is. The JSON is the input of the converter, and the profiler keeps its matchers
+    by it. The keys are not sorted, because the order of the JSON schema properties decides the
+    generated grammar."""
+    structural_tag = {"type": "structural_tag", "format": structural_tag_format}
+    return json.dumps(structural_tag, ensure_ascii=False)
+
+
+@_get_structural_tag_json.register
+def _(structural_tag: StructuralTag) -> str:
+    return structural_tag.model_dump_json()
 
 
 class Profiler:
     def __init__(self, tokenizer_id: str):
+        # The tokenizer and compiler are loaded on the first profile_stag call, so constructing a
+        # profiler that is never used is cheap.
+        self.tokenizer_id = tokenizer_id
+        # Many parametrized cases share a structural tag, so compile each one only once and reset
+        # its matcher between instances. Matchers are stateful and every fill writes the bitmask,
+        # and the CI runs each test in several threads at once, so every thread keeps its own
+        # matchers and its own bitmask with one row per input byte.
+        self._local = threading.local()
+
+    def _get_matcher_cache(self) -> Dict[str, xgr.GrammarMatcher]:
+        return self._local.__dict__.setdefault("matchers", {})
+
+    @functools.cached_property
+    def tokenizer_info(self) -> xgr.TokenizerInfo:
         tokenizer = AutoTokenizer.from_pretrained(
-            tokenizer_id, use_fast=True, trust_remote_code=True
-        )
-        self.tokenizer_info = xgr.TokenizerInfo.from_huggingface(tokenizer)
-        self.compiler = xgr.GrammarCompiler(
-            self.tokenizer_info, max_threads=16, cache_enabled=False
+            self.tokenizer_id, use_fast=True, trust_remote_code=True
         )
+        return xgr.TokenizerInfo.from_huggingface(tokenizer)
+
+    @functools.cached_property
+    def compiler(self) -> xgr.GrammarCompiler:
+        # The profiler is shared by the whole module, so let the compiler cache the compiled
+        # grammars across the tests as well.
+        return xgr.GrammarCompiler(self.tokenizer_info, max_threads=16, cache_enabled=True)
 
     def profile_stag(
         self, structural_tag_format: Union[Dict[str, Any], StructuralTag], instance: str
     ):
-        if isinstance(structural_tag_format, StructuralTag):
-            structural_tag = structural_tag_format
+        lines = []
+        cache_key = _get_structural_tag_json(structural_tag_format)
+        matcher_cache = self._get_matcher_cache()
+        matcher = matcher_cache.get(cache_key)
+        if matcher is None:
+            time_begin = time.perf_counter_ns()
+            compiled_grammar = self.compiler.compile_structural_tag(cache_key)
+            time_end = time.perf_counter_ns()
+            compiler_duration = time_end - time_begin
+            lines.append(f"Compiling structural tag {structural_tag_format}")
+            lines.append(f"Compile time: {compiler_duration / 1000 / 1000} ms")
+            matcher = xgr.GrammarMatcher(compiled_grammar)
+            matcher_cache[cache_key] = matcher
         else:
-            structural_tag = {"type": "structural_tag", "format": structural_tag_format}
-        time_begin = time.monotonic_ns()
-        compiled_grammar = self.compiler.compile_structural_tag(structural_tag)
-        time_end = time.monotonic_ns()
-        compiler_duration = time_end - time_begin
-        print(f"Compiling structural tag {structural_tag_format}")
-        print(f"Compile time: {compiler_duration / 1000 / 1000} ms")
-        matcher = xgr.GrammarMatcher(compiled_grammar)
-        token_bitmask = xgr.allocate_token_bitmask(1, self.tokenizer_info.vocab_size)
-
-        print(f"Matching instance: {instance}")
-
-        for char in instance:
-            matcher.accept_string(char)
-            time_begin = time.monotonic_ns()
-            matcher.fill_next_token_bitmask(token_bitmask)
-            time_end = time.monotonic_ns()
+            matcher.reset()
+        input_bytes = instance.encode("utf-8")
+        token_bitmask: Optional[torch.Tensor] = getattr(self._local, "token_bitmask", None)
+        num_rows = 0 if token_bitmask is None else token_bitmask.shape[0]
+        if num_rows < len(input_bytes):
+            # Grow geometrically so that a run of slightly longer instances does not reallocate
+            # every time. Every row is overwritten by the fill, so the buffer is never reset.
+            num_rows = max(len(input_bytes), 2 * num_rows, 64)
+            token_bitmask = xgr.allocate_token_bitmask(num_rows, self.tokenizer_info.vocab_size)
+            self._local.token_bitmask = token_bitmask
+
+        # The accept/fill loop runs in C++, so the timings exclude the Python call overhead.
+        _, durations = _fill_next_token_bitmask_for_prefixes(
+            matcher, input_bytes, token_bitmask, return_durations=True
+        )
 
-            duration = time_end - time_begin
-            print(f"Time to generate mask: {duration / 1000} us, Character: '{char}'")
+        lines.append(f"Matching instance: {instance}")
+        lines.extend(
+            f"Time to generate mask: {duration / 1000} us, Prefix bytes: {i}"
+            for i, duration in enumerate(durations)
+        )
+        if durations:
+            lines.append(
+                f"Mean time to generate mask: {sum(durations) / len(durations) / 1000} us "
+                f"over {len(durations)} prefixes"
+            )
+        print("\n".join(lines))
 
 
 profiler: Optional[Profiler] = None
@@ -67,10 +130,20 @@ def disable_profiler(request):
         profiler = Profiler(tokenizer_id)
 
 
+def _assert_grammar_eq(actual: str, expected: str):
+    """Assert that the grammar strings are equal. On a mismatch, fail with a unified diff of the
+    grammar lines, which pytest would otherwise truncate without -vv."""
+    if actual == expected:
+        return
+    diff = difflib.unified_diff(
+        expected.splitlines(), actual.splitlines(), "expected", "actual", lineterm=""
+    )
+    pytest.fail("Grammar mismatch:\n" + "\n".join(diff))
+
+
 def check_stag_with_grammar(structural_tag_format: Dict[str, Any], expected_grammar_ebnf: str):
-    structural_tag = {"type": "structural_tag", "format": structural_tag_format}
-    stag_ebnf = xgr.Grammar.from_structural_tag(structural_tag)
-    assert str(stag_ebnf) == expected_grammar_ebnf
+    stag_grammar = xgr.Grammar.from_structural_tag(_get_structural_tag_json(structural_tag_format))
+    _assert_grammar_eq(str(stag_grammar), expected_grammar_ebnf)
 
 
 def check_stag_with_instance(
@@ -79,17 +152,29 @@ def check_stag_with_instance(
     is_accepted: bool = True,
     debug_print: bool = False,
 ):
-    if isinstance(structural_tag_format, StructuralTag):
-        stag_grammar = xgr.Grammar.from_structural_tag(structural_tag_format)
-    else:
-        structural_tag = {"type": "structural_tag", "format": structural_tag_format}
-        stag_grammar = xgr.Grammar.from_structural_tag(structural_tag)
+    stag_grammar = xgr.Grammar.from_structural_tag(_get_structural_tag_json(structural_tag_format))
     accepted = _is_grammar_accept_string(stag_grammar, instance, debug_print=debug_print)
     assert accepted == is_accepted
     if PROFILER_ON:
         profiler.profile_stag(structural_tag_format, instance)
 
 
+def check_stag_with_instances(
+    structural_tag_format: Union[Dict[str, Any], StructuralTag],
+    instance_is_accepted_tuples: List[Tuple[str, bool]],
+):
+    """Like check_stag_with_instance for several instances, but the instances are matched in one
+    call."""
+    stag_grammar = xgr.Grammar.from_structural_tag(_get_structural_tag_json(structural_tag_format))
+    instances = [instance for instance, _ in instance_is_accepted_tuples]
+    accepted = _are_grammar_accept_strings(stag_grammar, instances)
+    results = list(zip(instances, accepted))
+    assert results == instance_is_accepted_tuples
+    if PROFILER_ON:
+        for instance, _ in instance_is_accepted_tuples:
+            profiler.profile_stag(structural_tag_format, instance)
+
+
 const_string_stag_grammar = [
     (
         {"type": "const_string", "value": "Hello!"},
@@ -724,8 +809,7 @@ def test_triggered_tags_corner_case(
     instance_is_accepted_tuples: List[Tuple[str, bool]],
 ):
     check_stag_with_grammar(stag_format, expected_grammar)
-    for instance, is_accepted in instance_is_accepted_tuples:
-        check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instances(stag_format, instance_is_accepted_tuples)
 
 
 triggered_tag_format = {
@@ -851,6 +935,103 @@ def test_triggered_tag_with_outside_tag(
     check_stag_with_instance(stag_format, instance, accepted_results[stag_id])
 
 
+# The order of the (at_least_one, stop_after_first) variants in the tags_with_separator tests.
+_SEPARATOR_FLAGS = ((False, False), (True, False), (False, True), (True, True))
+
+
+@functools.lru_cache(maxsize=None)
+def _tags_with_separator_grammar_head(tags: Tuple[Tuple[str, str, str], ...]) -> str:
+    """The rules of the tags, which are the same in every variant of a tags_with_separator test."""
+    lines = []
+    tag_names = []
+    for i, (begin, value, end) in enumerate(tags):
+        suffix = f"_{i}" if i else ""
+        lines.append(f'const_string{suffix} ::= (("{value}"))')
+        lines.append(f'tag{suffix} ::= (("{begin}" const_string{suffix} "{end}"))')
+        tag_names.append(f"(tag{suffix})")
+    lines.append(f"tags_with_separator_tags ::= ({' | '.join(tag_names)})")
+    return "\n".join(lines) + "\n"
+
+
+def _expected_tags_with_separator_grammar(
+    tags: List[Tuple[str, str, str]],
+    separator: str,
+    at_least_one: bool,
+    stop_after_first: bool,
+    outside_tag: Optional[Tuple[str, str]] = None,
+) -> str:
+    """Build the expected grammar of a tags_with_separator format. Each tag is given as
+    (begin, const_string value, end), and outside_tag as (begin, end) wraps the whole format."""
+    # The end of the outside tag is merged into the rules that can finish the format.
+    outside_end = None if outside_tag is None else outside_tag[1]
+
+    def rule_body(sequence: str, allow_empty: bool) -> str:
+        if not allow_empty:
+            return f"(({sequence}))"
+        if outside_end is None:
+            return f'("" | ({sequence}))'
+        return f'(({sequence}) | ("{outside_end}"))'
+
+    lines = []
+    if stop_after_first:
+        rest = "" if outside_end is None else f' "{outside_end}"'
+    else:
+        sep = f'"{separator}" ' if separator else ""
+        sub_body = rule_body(f"{sep}tags_with_separator_tags tags_with_separator_sub", True)
+        lines.append(f"tags_with_separator_sub ::= {sub_body}")
+        rest = " tags_with_separator_sub"
+    top_body = rule_body(f"tags_with_separator_tags{rest}", not at_least_one)
+    lines.append(f"tags_with_separator ::= {top_body}")
+
+    if outside_tag is None:
+        lines.append("root ::= ((tags_with_separator))")
+    else:
+        outside_tag_name = f"tag_{len(tags)}"
+        lines.append(f'{outside_tag_name} ::= (("{outside_tag[0]}" tags_with_separator))')
+        lines.append(f"root ::= (({outside_tag_name}))")
+    return _tags_with_separator_grammar_head(tuple(tags)) + "\n".join(lines) + "\n"
+
+
+def _get_tags_with_separator_stag_grammar(
+    get_format: Callable[[bool, bool], Dict[str, Any]],
+    tags: List[Tuple[str, str, str]],
+    separator: str,
+    outside_tag: Optional[Tuple[str, str]] = None,
+    literal_grammars: Optional[Dict[int, str]] = None,
+) -> List[Tuple[int, Dict[str, Any], str]]:
+    """Build the (stag_id, stag_format, expected_grammar) cases of a tags_with_separator test, one
+    for each variant in _SEPARATOR_FLAGS. get_format builds the format of a variant. The variants
+    in literal_grammars use the given grammar instead of the generated one, so that the expected
+    output is also written out by hand and not only derived the same way as the converter."""
+    literal_grammars = literal_grammars or {}
+    return [
+        (
+            stag_id,
+            get_format(*flags),
+            literal_grammars.get(stag_id)
+            or _expected_tags_with_separator_grammar(
+                tags, separator, *flags, outside_tag=outside_tag
+            ),
+        )
+        for stag_id, flags in enumerate(_SEPARATOR_FLAGS)
+    ]
+
+
+def _split_uniform_results(
+    instance_accepted_results: List[Tuple[str, List[bool]]]
+) -> Tuple[List[Tuple[str, List[bool]]], List[Tuple[str, bool]]]:
+    """Split the instances into those accepted by only some of the variants, and those accepted
+    or rejected by all of them, which are returned as (instance, is_accepted)."""
+    mixed = []
+    uniform = []
+    for instance, accepted_results in instance_accepted_results:
+        if len(set(accepted_results)) == 1:
+            uniform.append((instance, accepted_results[0]))
+        else:
+            mixed.append((instance, accepted_results))
+    return mixed, uniform
+
+
 def _get_tags_with_separator_format(at_least_one: bool, stop_after_first: bool):
     return {
         "type": "tags_with_separator",
@@ -864,11 +1045,12 @@ def _get_tags_with_separator_format(at_least_one: bool, stop_after_first: bool):
     }
 
 
-tags_with_separator_stag_grammar = [
-    (
-        0,
-        _get_tags_with_separator_format(at_least_one=False, stop_after_first=False),
-        r"""const_string ::= (("L1"))
+tags_with_separator_stag_grammar = _get_tags_with_separator_stag_grammar(
+    _get_tags_with_separator_format,
+    [("A1", "L1", "A"), ("A2", "L2", "A")],
+    "AA",
+    literal_grammars={
+        0: r"""const_string ::= (("L1"))
 tag ::= (("A1" const_string "A"))
 const_string_1 ::= (("L2"))
 tag_1 ::= (("A2" const_string_1 "A"))
@@ -877,24 +1059,7 @@ tags_with_separator_sub ::= ("" | ("AA" tags_with_separator_tags tags_with_separ
 tags_with_separator ::= ("" | (tags_with_separator_tags tags_with_separator_sub))
 root ::= ((tags_with_separator))
 """,
-    ),
-    (
-        1,
-        _get_tags_with_separator_format(at_least_one=True, stop_after_first=False),
-        r"""const_string ::= (("L1"))
-tag ::= (("A1" const_string "A"))
-const_string_1 ::= (("L2"))
-tag_1 ::= (("A2" const_string_1 "A"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator_sub ::= ("" | ("AA" tags_with_separator_tags tags_with_separator_sub))
-tags_with_separator ::= ((tags_with_separator_tags tags_with_separator_sub))
-root ::= ((tags_with_separator))
-""",
-    ),
-    (
-        2,
-        _get_tags_with_separator_format(at_least_one=False, stop_after_first=True),
-        r"""const_string ::= (("L1"))
+        2: r"""const_string ::= (("L1"))
 tag ::= (("A1" const_string "A"))
 const_string_1 ::= (("L2"))
 tag_1 ::= (("A2" const_string_1 "A"))
@@ -902,20 +1067,8 @@ tags_with_separator_tags ::= ((tag) | (tag_1))
 tags_with_separator ::= ("" | (tags_with_separator_tags))
 root ::= ((tags_with_separator))
 """,
-    ),
-    (
-        3,
-        _get_tags_with_separator_format(at_least_one=True, stop_after_first=True),
-        r"""const_string ::= (("L1"))
-tag ::= (("A1" const_string "A"))
-const_string_1 ::= (("L2"))
-tag_1 ::= (("A2" const_string_1 "A"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator ::= ((tags_with_separator_tags))
-root ::= ((tags_with_separator))
-""",
-    ),
-]
+    },
+)
 
 
 tags_with_separator_instance_accepted_results = [
@@ -927,20 +1080,36 @@ tags_with_separator_instance_accepted_results = [
 
 
 @pytest.mark.parametrize("stag_id, stag_format, expected_grammar", tags_with_separator_stag_grammar)
+def test_tags_with_separator_format_grammar(
+    stag_id: int, stag_format: Dict[str, Any], expected_grammar: str
+):
+    check_stag_with_grammar(stag_format, expected_grammar)
+
+
+tags_with_separator_mixed_results, tags_with_separator_uniform_results = _split_uniform_results(
+    tags_with_separator_instance_accepted_results
+)
+
+
 @pytest.mark.parametrize(
-    "instance, accepted_results", tags_with_separator_instance_accepted_results
+    "stag_id, stag_format",
+    [(stag_id, stag_format) for stag_id, stag_format, _ in tags_with_separator_stag_grammar],
 )
-def test_tags_with_separator_format(
-    stag_id: int,
-    stag_format: Dict[str, Any],
-    expected_grammar: str,
-    instance: str,
-    accepted_results: List[bool],
+@pytest.mark.parametrize("instance, accepted_results", tags_with_separator_mixed_results)
+def test_tags_with_separator_format_instance(
+    stag_id: int, stag_format: Dict[str, Any], instance: str, accepted_results: List[bool]
 ):
-    check_stag_with_grammar(stag_format, expected_grammar)
     check_stag_with_instance(stag_format, instance, accepted_results[stag_id])
 
 
+# The instances with the same result for every variant are checked against all the variants
+# in one test.
+@pytest.mark.parametrize("instance, is_accepted", tags_with_separator_uniform_results)
+def test_tags_with_separator_format_uniform_instance(instance: str, is_accepted: bool):
+    for _, stag_format, _ in tags_with_separator_stag_grammar:
+        check_stag_with_instance(stag_format, instance, is_accepted)
+
+
 def _get_tags_with_separator_format_with_outside_tag(at_least_one: bool, stop_after_first: bool):
     return {
         "type": "tag",
@@ -959,13 +1128,13 @@ def _get_tags_with_separator_format_with_outside_tag(at_least_one: bool, stop_af
     }
 
 
-tags_with_separator_with_outside_tag_stag_grammar = [
-    (
-        0,
-        _get_tags_with_separator_format_with_outside_tag(
-            at_least_one=False, stop_after_first=False
-        ),
-        r"""const_string ::= (("L1"))
+tags_with_separator_with_outside_tag_stag_grammar = _get_tags_with_separator_stag_grammar(
+    _get_tags_with_separator_format_with_outside_tag,
+    [("A1", "L1", "A"), ("A2", "L2", "A")],
+    "AA",
+    outside_tag=("begin", "end"),
+    literal_grammars={
+        0: r"""const_string ::= (("L1"))
 tag ::= (("A1" const_string "A"))
 const_string_1 ::= (("L2"))
 tag_1 ::= (("A2" const_string_1 "A"))
@@ -974,49 +1143,9 @@ tags_with_separator_sub ::= (("AA" tags_with_separator_tags tags_with_separator_
 tags_with_separator ::= ((tags_with_separator_tags tags_with_separator_sub) | ("end"))
 tag_2 ::= (("begin" tags_with_separator))
 root ::= ((tag_2))
-""",
-    ),
-    (
-        1,
-        _get_tags_with_separator_format_with_outside_tag(at_least_one=True, stop_after_first=False),
-        r"""const_string ::= (("L1"))
-tag ::= (("A1" const_string "A"))
-const_string_1 ::= (("L2"))
-tag_1 ::= (("A2" const_string_1 "A"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator_sub ::= (("AA" tags_with_separator_tags tags_with_separator_sub) | ("end"))
-tags_with_separator ::= ((tags_with_separator_tags tags_with_separator_sub))
-tag_2 ::= (("begin" tags_with_separator))
-root ::= ((tag_2))
-""",
-    ),
-    (
-        2,
-        _get_tags_with_separator_format_with_outside_tag(at_least_one=False, stop_after_first=True),
-        r"""const_string ::= (("L1"))
-tag ::= (("A1" const_string "A"))
-const_string_1 ::= (("L2"))
-tag_1 ::= (("A2" const_string_1 "A"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator ::= ((tags_with_separator_tags "end") | ("end"))
-tag_2 ::= (("begin" tags_with_separator))
-root ::= ((tag_2))
-""",
-    ),
-    (
-        3,
-        _get_tags_with_separator_format_with_outside_tag(at_least_one=True, stop_after_first=True),
-        r"""const_string ::= (("L1"))
-tag ::= (("A1" const_string "A"))
-const_string_1 ::= (("L2"))
-tag_1 ::= (("A2" const_string_1 "A"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator ::= ((tags_with_separator_tags "end"))
-tag_2 ::= (("begin" tags_with_separator))
-root ::= ((tag_2))
-""",
-    ),
-]
+"""
+    },
+)
 
 
 tags_with_separator_with_outside_tag_instance_accepted_results = [
@@ -1031,20 +1160,44 @@ tags_with_separator_with_outside_tag_instance_accepted_results = [
 @pytest.mark.parametrize(
     "stag_id, stag_format, expected_grammar", tags_with_separator_with_outside_tag_stag_grammar
 )
+def test_tags_with_separator_format_with_outside_tag_grammar(
+    stag_id: int, stag_format: Dict[str, Any], expected_grammar: str
+):
+    check_stag_with_grammar(stag_format, expected_grammar)
+
+
+(
+    tags_with_separator_with_outside_tag_mixed_results,
+    tags_with_separator_with_outside_tag_uniform_results,
+) = _split_uniform_results(tags_with_separator_with_outside_tag_instance_accepted_results)
+
+
+@pytest.mark.parametrize(
+    "stag_id, stag_format",
+    [
+        (stag_id, stag_format)
+        for stag_id, stag_format, _ in tags_with_separator_with_outside_tag_stag_grammar
+    ],
+)
 @pytest.mark.parametrize(
-    "instance, accepted_results", tags_with_separator_with_outside_tag_instance_accepted_results
+    "instance, accepted_results", tags_with_separator_with_outside_tag_mixed_results
 )
-def test_tags_with_separator_format_with_outside_tag(
-    stag_id: int,
-    stag_format: Dict[str, Any],
-    expected_grammar: str,
-    instance: str,
-    accepted_results: List[bool],
+def test_tags_with_separator_format_with_outside_tag_instance(
+    stag_id: int, stag_format: Dict[str, Any], instance: str, accepted_results: List[bool]
 ):
-    check_stag_with_grammar(stag_format, expected_grammar)
     check_stag_with_instance(stag_format, instance, accepted_results[stag_id])
 
 
+@pytest.mark.parametrize(
+    "instance, is_accepted", tags_with_separator_with_outside_tag_uniform_results
+)
+def test_tags_with_separator_format_with_outside_tag_uniform_instance(
+    instance: str, is_accepted: bool
+):
+    for _, stag_format, _ in tags_with_separator_with_outside_tag_stag_grammar:
+        check_stag_with_instance(stag_format, instance, is_accepted)
+
+
 # Test for empty separator in tags_with_separator
 def _get_tags_with_empty_separator_format(at_least_one: bool, stop_after_first: bool):
     return {
@@ -1059,11 +1212,12 @@ def _get_tags_with_empty_separator_format(at_least_one: bool, stop_after_first:
     }
 
 
-tags_with_empty_separator_stag_grammar = [
-    (
-        0,
-        _get_tags_with_empty_separator_format(at_least_one=False, stop_after_first=False),
-        r"""const_string ::= (("X"))
+tags_with_empty_separator_stag_grammar = _get_tags_with_separator_stag_grammar(
+    _get_tags_with_empty_separator_format,
+    [("<a>", "X", "</a>"), ("<b>", "Y", "</b>")],
+    "",
+    literal_grammars={
+        0: r"""const_string ::= (("X"))
 tag ::= (("<a>" const_string "</a>"))
 const_string_1 ::= (("Y"))
 tag_1 ::= (("<b>" const_string_1 "</b>"))
@@ -1071,46 +1225,9 @@ tags_with_separator_tags ::= ((tag) | (tag_1))
 tags_with_separator_sub ::= ("" | (tags_with_separator_tags tags_with_separator_sub))
 tags_with_separator ::= ("" | (tags_with_separator_tags tags_with_separator_sub))
 root ::= ((tags_with_separator))
-""",
-    ),
-    (
-        1,
-        _get_tags_with_empty_separator_format(at_least_one=True, stop_after_first=False),
-        r"""const_string ::= (("X"))
-tag ::= (("<a>" const_string "</a>"))
-const_string_1 ::= (("Y"))
-tag_1 ::= (("<b>" const_string_1 "</b>"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator_sub ::= ("" | (tags_with_separator_tags tags_with_separator_sub))
-tags_with_separator ::= ((tags_with_separator_tags tags_with_separator_sub))
-root ::= ((tags_with_separator))
-""",
-    ),
-    (
-        2,
-        _get_tags_with_empty_separator_format(at_least_one=False, stop_after_first=True),
-        r"""const_string ::= (("X"))
-tag ::= (("<a>" const_string "</a>"))
-const_string_1 ::= (("Y"))
-tag_1 ::= (("<b>" const_string_1 "</b>"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator ::= ("" | (tags_with_separator_tags))
-root ::= ((tags_with_separator))
-""",
-    ),
-    (
-        3,
-        _get_tags_with_empty_separator_format(at_least_one=True, stop_after_first=True),
-        r"""const_string ::= (("X"))
-tag ::= (("<a>" const_string "</a>"))
-const_string_1 ::= (("Y"))
-tag_1 ::= (("<b>" const_string_1 "</b>"))
-tags_with_separator_tags ::= ((tag) | (tag_1))
-tags_with_separator ::= ((tags_with_separator_tags))
-root ::= ((tags_with_separator))
-""",
-    ),
-]
+"""
+    },
+)
 
 
 tags_with_empty_separator_instance_accepted_results = [
@@ -1128,35 +1245,53 @@ tags_with_empty_separator_instance_accepted_results = [
 @pytest.mark.parametrize(
     "stag_id, stag_format, expected_grammar", tags_with_empty_separator_stag_grammar
 )
+def test_tags_with_empty_separator_format_grammar(
+    stag_id: int, stag_format: Dict[str, Any], expected_grammar: str
+):
+    check_stag_with_grammar(stag_format, expected_grammar)
+
+
+tags_with_empty_separator_mixed_results, tags_with_empty_separator_uniform_results = (
+    _split_uniform_results(tags_with_empty_separator_instance_accepted_results)
+)
+
+
 @pytest.mark.parametrize(
-    "instance, accepted_results", tags_with_empty_separator_instance_accepted_results
+    "stag_id, stag_format",
+    [(stag_id, stag_format) for stag_id, stag_format, _ in tags_with_empty_separator_stag_grammar],
 )
-def test_tags_with_empty_separator_format(
-    stag_id: int,
-    stag_format: Dict[str, Any],
-    expected_grammar: str,
-    instance: str,
-    accepted_results: List[bool],
+@pytest.mark.parametrize("instance, accepted_results", tags_with_empty_separator_mixed_results)
+def test_tags_with_empty_separator_format_instance(
+    stag_id: int, stag_format: Dict[str, Any], instance: str, accepted_results: List[bool]
 ):
-    check_stag_with_grammar(stag_format, expected_grammar)
     check_stag_with_instance(stag_format, instance, accepted_results[stag_id])
 
 
+@pytest.mark.parametrize("instance, is_accepted", tags_with_empty_separator_uniform_results)
+def test_tags_with_empty_separator_format_uniform_instance(instance: str, is_accepted: bool):
+    for _, stag_format, _ in tags_with_empty_separator_stag_grammar:
+        check_stag_with_instance(stag_format, instance, is_accepted)
+
+
+# The tool arguments of the compound cases. The converter does not modify its input, so the cases
+# share one dict.
+_OBJECT_SCHEMA_FORMAT = {"type": "json_schema", "json_schema": {"type": "object"}}
+
 compound_stag_instance_is_accepted = [
     # Llama JSON-based tool calling
-    (
+    pytest.param(
         {
             "type": "triggered_tags",
             "triggers": ['{"name":'],
             "tags": [
                 {
                     "begin": '{"name": "func1", "parameters": ',
-                    "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                    "content": _OBJECT_SCHEMA_FORMAT,
                     "end": "}",
                 },
                 {
                     "begin": '{"name": "func2", "parameters": ',
-                    "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                    "content": _OBJECT_SCHEMA_FORMAT,
                     "end": "}",
                 },
             ],
@@ -1168,9 +1303,10 @@ compound_stag_instance_is_accepted = [
             ),
             ('<text>{"name": "func3", "parameters": {"arg": 10}}', False),
         ],
+        id="llama_json_tool_calling",
     ),
     # Force think
-    (
+    pytest.param(
         {
             "type": "sequence",
             "elements": [
@@ -1186,12 +1322,12 @@ compound_stag_instance_is_accepted = [
                     "tags": [
                         {
                             "begin": "<function=func1>",
-                            "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                            "content": _OBJECT_SCHEMA_FORMAT,
                             "end": "</function>",
                         },
                         {
                             "begin": "<function=func2>",
-                            "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                            "content": _OBJECT_SCHEMA_FORMAT,
                             "end": "</function>",
                         },
                     ],
@@ -1209,9 +1345,10 @@ compound_stag_instance_is_accepted = [
             ),
             ('<think>[any_text]</think>[any_text]<function=func3>{"arg": 10}', False),
         ],
+        id="force_think",
     ),
     # Think & Force tool calling (Llama style)
-    (
+    pytest.param(
         {
             "type": "sequence",
             "elements": [
@@ -1227,12 +1364,12 @@ compound_stag_instance_is_accepted = [
                     "tags": [
                         {
                             "begin": "<function=func1>",
-                            "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                            "content": _OBJECT_SCHEMA_FORMAT,
                             "end": "</function>",
                         },
                         {
                             "begin": "<function=func2>",
-                            "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                            "content": _OBJECT_SCHEMA_FORMAT,
                             "end": "</function>",
                         },
                     ],
@@ -1246,9 +1383,10 @@ compound_stag_instance_is_accepted = [
             ('<think>[any_text]</think>[any_text]<function=func2>{"arg": 10}</function>', False),
             ('<think>[any_text]</think><function=func2>{"arg": 10}</function>[any_text]', False),
         ],
+        id="think_force_tool_calling_llama",
     ),
     # Think & force tool calling (DeepSeek style)
-    (
+    pytest.param(
         {
             "type": "sequence",
             "elements": [
@@ -1322,9 +1460,10 @@ compound_stag_instance_is_accepted = [
                 False,
             ),
         ],
+        id="think_force_tool_calling_deepseek",
     ),
     # Force non-think mode
-    (
+    pytest.param(
         {
             "type": "sequence",
             "elements": [
@@ -1335,12 +1474,12 @@ compound_stag_instance_is_accepted = [
                     "tags": [
                         {
                             "begin": '<tool_call>\n{"name": "func1", "arguments": ',
-                            "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                            "content": _OBJECT_SCHEMA_FORMAT,
                             "end": "}\n</tool_call>",
                         },
                         {
                             "begin": '<tool_call>\n{"name": "func2", "arguments": ',
-                            "content": {"type": "json_schema", "json_schema": {"type": "object"}},
+                            "content": _OBJECT_SCHEMA_FORMAT,
                             "end": "}\n</tool_call>",
                         },
                     ],
@@ -1357,6 +1496,7 @@ compound_stag_instance_is_accepted = [
                 False,
             ),
         ],
+        id="force_non_think",
     ),
 ]
 
@@ -1367,12 +1507,11 @@ compound_stag_instance_is_accepted = [
 def test_compound_format(
     stag_format: Dict[str, Any], instance_is_accepted_tuples: List[Tuple[str, bool]]
 ):
-    for instance, is_accepted in instance_is_accepted_tuples:
-        check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instances(stag_format, instance_is_accepted_tuples)
 
 
 end_string_detector_test_data = [
-    (
+    pytest.param(
         {
             "type": "tag",
             "begin": "<start>",
@@ -1399,8 +1538,9 @@ root ::= ((tag))
             ("<start>[TEXT]abcde", False),
             ("<start><end>", False),
         ],
+        id="tag_end",
     ),
-    (
+    pytest.param(
         # Detect the end string for nested structures
         {
             "type": "tag",
@@ -1481,8 +1621,9 @@ root ::= ((tag_1))
             ("<start><end>", True),
             ("<start>[TEXT2]", False),
         ],
+        id="nested_tag_end",
     ),
-    (
+    pytest.param(
         # Also in nested structures, but none end string can be detected
         {
             "type": "or",
@@ -1576,6 +1717,7 @@ root ::= ((or_1))
             ("<start3>abc<end3><start3>def<end3>", False),
             ("random text", False),
         ],
+        id="nested_no_end",
     ),
 ]
 
@@ -1589,183 +1731,226 @@ def test_end_string_detector(
     instance_is_accepted_tuples: List[Tuple[str, bool]],
 ):
     check_stag_with_grammar(stag_format, expected_grammar)
-    for instance, is_accepted in instance_is_accepted_tuples:
-        check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instances(stag_format, instance_is_accepted_tuples)
 
 
-# Test cases for JSON format and parsing errors (need string input)
-json_format_error_test_data = [
-    # JSON Parsing Errors
+# The tag shared by the error cases below. The converter only reads its input, so the cases can
+# reference the same dict.
+_ERROR_CASE_TAG = {
+    "begin": "start",
+    "content": {"type": "const_string", "value": "hello"},
+    "end": "end",
+}
+# Base formats of the error cases below, each with one field removed or replaced
+_TAG_FORMAT = {"type": "tag", **_ERROR_CASE_TAG}
+_TRIGGERED_TAGS_FORMAT = {
+    "type": "triggered_tags",
+    "triggers": ["trigger"],
+    "tags": [_ERROR_CASE_TAG],
+}
+_TAGS_WITH_SEPARATOR_FORMAT = {
+    "type": "tags_with_separator",
+    "tags": [_ERROR_CASE_TAG],
+    "separator": "sep",
+}
+
+
+def _format_error_case(
+    base_format: Dict[str, Any], expected_error: str, drop: Tuple[str, ...] = (), **fields: Any
+) -> Tuple[Dict[str, Any], str]:
+    """Build a (structural tag, expected error) case from a base format, with the fields in
+    drop removed and the other given fields set. Only the top level of the format is copied."""
+    structural_tag_format = {key: value for key, value in base_format.items() if key not in drop}
+    structural_tag_format.update(fields)
+    return {"type": "structural_tag", "format": structural_tag_format}, expected_error
+
+
+# Test cases for JSON parsing errors, which need string input
+json_format_parse_error_test_data = [
     (
         '{"type": "structural_tag", "format": {"type": "const_string", "value": "hello"',
         "Failed to parse JSON",
     ),
     ('"not_an_object"', "Structural tag must be an object"),
+]
+
+
+# Test cases for format errors
+json_format_error_test_data = [
+    # Structural Tag Errors
     (
-        '{"type": "wrong_type", "format": {"type": "const_string", "value": "hello"}}',
+        {"type": "wrong_type", "format": {"type": "const_string", "value": "hello"}},
         'Structural tag\'s type must be a string "structural_tag"',
     ),
-    ('{"type": "structural_tag"}', "Structural tag must have a format field"),
+    ({"type": "structural_tag"}, "Structural tag must have a format field"),
     # Format Parsing Errors
-    ('{"type": "structural_tag", "format": "not_an_object"}', "Format must be an object"),
+    ({"type": "structural_tag", "format": "not_an_object"}, "Format must be an object"),
     (
-        '{"type": "structural_tag", "format": {"type": 123, "value": "hello"}}',
+        {"type": "structural_tag", "format": {"type": 123, "value": "hello"}},
         "Format's type must be a string",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "unknown_format"}}',
+        {"type": "structural_tag", "format": {"type": "unknown_format"}},
         "Format type not recognized: unknown_format",
     ),
-    ('{"type": "structural_tag", "format": {"invalid_field": "value"}}', "Invalid format"),
+    ({"type": "structural_tag", "format": {"invalid_field": "value"}}, "Invalid format"),
     # ConstStringFormat Errors
     (
-        '{"type": "structural_tag", "format": {"type": "const_string"}}',
+        {"type": "structural_tag", "format": {"type": "const_string"}},
         "ConstString format must have a value field with a non-empty string",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "const_string", "value": 123}}',
+        {"type": "structural_tag", "format": {"type": "const_string", "value": 123}},
         "ConstString format must have a value field with a non-empty string",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "const_string", "value": ""}}',
+        {"type": "structural_tag", "format": {"type": "const_string", "value": ""}},
         "ConstString format must have a value field with a non-empty string",
     ),
     # JSONSchemaFormat Errors
     (
-        '{"type": "structural_tag", "format": {"type": "json_schema"}}',
+        {"type": "structural_tag", "format": {"type": "json_schema"}},
         "JSON schema format must have a json_schema field with a object or boolean value",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "json_schema", "json_schema": "invalid"}}',
+        {"type": "structural_tag", "format": {"type": "json_schema", "json_schema": "invalid"}},
         "JSON schema format must have a json_schema field with a object or boolean value",
     ),
     # SequenceFormat Errors
     (
-        '{"type": "structural_tag", "format": {"type": "sequence"}}',
+        {"type": "structural_tag", "format": {"type": "sequence"}},
         "Sequence format must have an elements field with an array",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "sequence", "elements": "not_array"}}',
+        {"type": "structural_tag", "format": {"type": "sequence", "elements": "not_array"}},
         "Sequence format must have an elements field with an array",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "sequence", "elements": []}}',
+        {"type": "structural_tag", "format": {"type": "sequence", "elements": []}},
         "Sequence format must have at least one element",
     ),
     # OrFormat Errors
     (
-        '{"type": "structural_tag", "format": {"type": "or"}}',
+        {"type": "structural_tag", "format": {"type": "or"}},
         "Or format must have an elements field with an array",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "or", "elements": "not_array"}}',
+        {"type": "structural_tag", "format": {"type": "or", "elements": "not_array"}},
         "Or format must have an elements field with an array",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "or", "elements": []}}',
+        {"type": "structural_tag", "format": {"type": "or", "elements": []}},
         "Or format must have at least one element",
     ),
     # TagFormat Errors
-    (
-        '{"type": "structural_tag", "format": {"type": "tag", "content": {"type": "const_string", "value": "hello"}, "end": "end"}}',
-        "Tag format's begin field must be a string",
-    ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tag", "begin": 123, "content": {"type": "const_string", "value": "hello"}, "end": "end"}}',
-        "Tag format's begin field must be a string",
-    ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tag", "begin": "start", "end": "end"}}',
-        "Tag format must have a content field",
-    ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tag", "begin": "start", "content": {"type": "const_string", "value": "hello"}}}',
-        "Tag format must have an end field",
-    ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tag", "begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": 123}}',
-        "Tag format's end field must be a string or array of strings",
+    _format_error_case(_TAG_FORMAT, "Tag format's begin field must be a string", drop=("begin",)),
+    _format_error_case(_TAG_FORMAT, "Tag format's begin field must be a string", begin=123),
+    _format_error_case(_TAG_FORMAT, "Tag format must have a content field", drop=("content",)),
+    _format_error_case(_TAG_FORMAT, "Tag format must have an end field", drop=("end",)),
+    _format_error_case(
+        _TAG_FORMAT, "Tag format's end field must be a string or array of strings", end=123
     ),
     # TriggeredTagsFormat Errors
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}]}}',
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT,
         "Triggered tags format must have a triggers field with an array",
+        drop=("triggers",),
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": "not_array", "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}]}}',
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT,
         "Triggered tags format must have a triggers field with an array",
+        triggers="not_array",
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": [], "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}]}}',
-        "Triggered tags format's triggers must be non-empty",
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT, "Triggered tags format's triggers must be non-empty", triggers=[]
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": [123], "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}]}}',
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT,
         "Triggered tags format's triggers must be non-empty strings",
+        triggers=[123],
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": [""], "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}]}}',
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT,
         "Triggered tags format's triggers must be non-empty strings",
+        triggers=[""],
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": ["trigger"]}}',
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT,
         "Triggered tags format must have a tags field with an array",
+        drop=("tags",),
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": ["trigger"], "tags": "not_array"}}',
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT,
         "Triggered tags format must have a tags field with an array",
+        tags="not_array",
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": ["trigger"], "tags": []}}',
-        "Triggered tags format's tags must be non-empty",
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT, "Triggered tags format's tags must be non-empty", tags=[]
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": ["trigger"], "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}], "at_least_one": "not_boolean"}}',
-        "at_least_one must be a boolean",
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT, "at_least_one must be a boolean", at_least_one="not_boolean"
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "triggered_tags", "triggers": ["trigger"], "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}], "stop_after_first": "not_boolean"}}',
-        "stop_after_first must be a boolean",
+    _format_error_case(
+        _TRIGGERED_TAGS_FORMAT, "stop_after_first must be a boolean", stop_after_first="not_boolean"
     ),
     # TagsWithSeparatorFormat Errors
-    (
-        '{"type": "structural_tag", "format": {"type": "tags_with_separator", "separator": "sep"}}',
+    _format_error_case(
+        _TAGS_WITH_SEPARATOR_FORMAT,
         "Tags with separator format must have a tags field with an array",
+        drop=("tags",),
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tags_with_separator", "tags": "not_array", "separator": "sep"}}',
+    _format_error_case(
+        _TAGS_WITH_SEPARATOR_FORMAT,
         "Tags with separator format must have a tags field with an array",
+        tags="not_array",
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tags_with_separator", "tags": [], "separator": "sep"}}',
-        "Tags with separator format's tags must be non-empty",
+    _format_error_case(
+        _TAGS_WITH_SEPARATOR_FORMAT, "Tags with separator format's tags must be non-empty", tags=[]
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tags_with_separator", "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}]}}',
+    _format_error_case(
+        _TAGS_WITH_SEPARATOR_FORMAT,
         "Tags with separator format's separator field must be a string",
+        drop=("separator",),
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tags_with_separator", "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}], "separator": 123}}',
+    _format_error_case(
+        _TAGS_WITH_SEPARATOR_FORMAT,
         "Tags with separator format's separator field must be a string",
+        separator=123,
     ),
     # Note: empty separator is now valid, so no error test for it
-    (
-        '{"type": "structural_tag", "format": {"type": "tags_with_separator", "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}], "separator": "sep", "at_least_one": "not_boolean"}}',
-        "at_least_one must be a boolean",
+    _format_error_case(
+        _TAGS_WITH_SEPARATOR_FORMAT, "at_least_one must be a boolean", at_least_one="not_boolean"
     ),
-    (
-        '{"type": "structural_tag", "format": {"type": "tags_with_separator", "tags": [{"begin": "start", "content": {"type": "const_string", "value": "hello"}, "end": "end"}], "separator": "sep", "stop_after_first": "not_boolean"}}',
+    _format_error_case(
+        _TAGS_WITH_SEPARATOR_FORMAT,
         "stop_after_first must be a boolean",
+        stop_after_first="not_boolean",
     ),
     (
-        '{"type": "structural_tag", "format": {"type": "json_schema", "json_schema": {"type": "string"}, "style": "not_string"}}',
+        {
+            "type": "structural_tag",
+            "format": {
+                "type": "json_schema",
+                "json_schema": {"type": "string"},
+                "style": "not_string",
+            },
+        },
         'style must be "json" or "qwen_xml"',
     ),
 ]
 
 
-@pytest.mark.parametrize("json_input, expected_error", json_format_error_test_data)
-def test_structural_tag_json_format_errors(json_input: str, expected_error: str):
+@pytest.mark.parametrize(
+    "json_input, expected_error",
+    json_format_parse_error_test_data + json_format_error_test_data,
+    ids=[
+        expected_error
+        for _, expected_error in json_format_parse_error_test_data + json_format_error_test_data
+    ],
+)
+def test_structural_tag_json_format_errors(
+    json_input: Union[str, Dict[str, Any]], expected_error: str
+):
     """Test JSON format and parsing errors that occur during JSON parsing phase"""
     with pytest.raises(Exception) as exc_info:
         xgr.Grammar.from_structural_tag(json_input)
@@ -1774,98 +1959,130 @@ def test_structural_tag_json_format_errors(json_input: str, expected_error: str)
 
 structural_tag_error_test_data = [
     # Analyzer Errors - Only last element in sequence can be unlimited
-    {
-        "type": "sequence",
-        "elements": [
-            {"type": "const_string", "value": "start"},
-            {"type": "any_text"},  # This unlimited element in middle will cause error
-            {"type": "const_string", "value": "end"},
-        ],
-    },
+    pytest.param(
+        {
+            "type": "sequence",
+            "elements": [
+                {"type": "const_string", "value": "start"},
+                {"type": "any_text"},  # This unlimited element in middle will cause error
+                {"type": "const_string", "value": "end"},
+            ],
+        },
+        id="sequence_unlimited_in_middle",
+    ),
     # Analyzer Errors - Or format with mixed unlimited and limited elements
-    {
-        "type": "or",
-        "elements": [
-            {"type": "const_string", "value": "limited"},  # Limited element
-            {"type": "any_text"},  # Unlimited element - mix not allowed
-        ],
-    },
+    pytest.param(
+        {
+            "type": "or",
+            "elements": [
+                {"type": "const_string", "value": "limited"},  # Limited element
+                {"type": "any_text"},  # Unlimited element - mix not allowed
+            ],
+        },
+        id="or_mixed_unlimited",
+    ),
     # Analyzer Errors - Tag format with unlimited content but empty end
-    {
-        "type": "tag",
-        "begin": "start",
-        "content": {"type": "any_text"},  # Unlimited content
-        "end": "",  # Empty end with unlimited content causes error
-    },
+    pytest.param(
+        {
+            "type": "tag",
+            "begin": "start",
+            "content": {"type": "any_text"},  # Unlimited content
+            "end": "",  # Empty end with unlimited content causes error
+        },
+        id="tag_unlimited_content_empty_end",
+    ),
     # Converter Errors - Tag matches multiple triggers
-    {
-        "type": "triggered_tags",
-        "triggers": ["A", "AB"],  # Both will match tag beginning with "ABC"
-        "tags": [
-            {"begin": "ABC", "content": {"type": "const_string", "value": "hello"}, "end": "end"}
-        ],
-    },
+    pytest.param(
+        {
+            "type": "triggered_tags",
+            "triggers": ["A", "AB"],  # Both will match tag beginning with "ABC"
+            "tags": [
+                {
+                    "begin": "ABC",
+                    "content": {"type": "const_string", "value": "hello"},
+                    "end": "end",
+                }
+            ],
+        },
+        id="tag_matches_multiple_triggers",
+    ),
     # Converter Errors - Tag matches no trigger
-    {
-        "type": "triggered_tags",
-        "triggers": ["X", "Y"],  # Neither matches "ABC" begin
-        "tags": [
-            {"begin": "ABC", "content": {"type": "const_string", "value": "hello"}, "end": "end"}
-        ],
-    },
+    pytest.param(
+        {
+            "type": "triggered_tags",
+            "triggers": ["X", "Y"],  # Neither matches "ABC" begin
+            "tags": [
+                {
+                    "begin": "ABC",
+                    "content": {"type": "const_string", "value": "hello"},
+                    "end": "end",
+                }
+            ],
+        },
+        id="tag_matches_no_trigger",
+    ),
     # Cannot detect end string of tags_with_separator in sequence
-    {
-        "type": "sequence",
-        "elements": [
-            {
-                "type": "tags_with_separator",
-                "tags": [
-                    {
-                        "begin": "<start>",
-                        "content": {"type": "const_string", "value": "[TEXT]"},
-                        "end": "<end>",
-                    }
-                ],
-                "separator": "<sep>",
-            },
-            {"type": "const_string", "value": "[TEXT]"},
-        ],
-    },
+    pytest.param(
+        {
+            "type": "sequence",
+            "elements": [
+                {
+                    "type": "tags_with_separator",
+                    "tags": [
+                        {
+                            "begin": "<start>",
+                            "content": {"type": "const_string", "value": "[TEXT]"},
+                            "end": "<end>",
+                        }
+                    ],
+                    "separator": "<sep>",
+                },
+                {"type": "const_string", "value": "[TEXT]"},
+            ],
+        },
+        id="tags_with_separator_in_sequence",
+    ),
     # Cannot detect end string of tags_with_separator in or
-    {
-        "type": "or",
-        "elements": [
-            {
+    pytest.param(
+        {
+            "type": "or",
+            "elements": [
+                {
+                    "type": "tags_with_separator",
+                    "tags": [
+                        {
+                            "begin": "<start>",
+                            "content": {"type": "const_string", "value": "[TEXT]"},
+                            "end": "<end>",
+                        }
+                    ],
+                    "separator": "<sep>",
+                },
+                {"type": "const_string", "value": "[TEXT]"},
+            ],
+        },
+        id="tags_with_separator_in_or",
+    ),
+    # Original test cases - Detected end string of tags_with_separator is empty
+    pytest.param(
+        {
+            "type": "tag",
+            "begin": "<start>",
+            "content": {
                 "type": "tags_with_separator",
                 "tags": [
                     {
-                        "begin": "<start>",
+                        "begin": "<start2>",
                         "content": {"type": "const_string", "value": "[TEXT]"},
-                        "end": "<end>",
+                        "end": "<end2>",
                     }
                 ],
                 "separator": "<sep>",
             },
-            {"type": "const_string", "value": "[TEXT]"},
-        ],
-    },
-    # Original test cases - Detected end string of tags_with_separator is empty
-    {
-        "type": "tag",
-        "begin": "<start>",
-        "content": {
-            "type": "tags_with_separator",
-            "tags": [
-                {
-                    "begin": "<start2>",
-                    "content": {"type": "const_string", "value": "[TEXT]"},
-                    "end": "<end2>",
-                }
-            ],
-            "separator": "<sep>",
+            "end": "",
         },
-        "end": "",
-    },
+        id="tags_with_separator_empty_end",
+    ),
 ]
 
 
@@ -1873,14 +2090,13 @@ structural_tag_error_test_data = [
 def test_structural_tag_error(stag_format: Dict[str, Any]):
     """Test analyzer and converter errors that occur after successful parsing"""
     structural_tag = {"type": "structural_tag", "format": stag_format}
-    with pytest.raises(Exception, match="Invalid structural tag error"):
+    with pytest.raises(xgr.InvalidStructuralTagError, match="Invalid structural tag error"):
         xgr.Grammar.from_structural_tag(structural_tag)
 
 
-utf8_stag_format_and_instance_accepted = [
-    ({"type": "const_string", "value": "你好"}, "你好", True),
-    ({"type": "const_string", "value": "你好"}, "hello", False),
-    ({"type": "any_text"}, "😊", True),
+utf8_stag_format_instance_is_accepted = [
+    ({"type": "const_string", "value": "你好"}, [("你好", True), ("hello", False)]),
+    ({"type": "any_text"}, [("😊", True)]),
     (
         {
             "type": "sequence",
@@ -1890,30 +2106,11 @@ utf8_stag_format_and_instance_accepted = [
                 {"type": "const_string", "value": "结束"},
             ],
         },
-        '开始"中间"结束',
-        True,
-    ),
-    (
-        {
-            "type": "sequence",
-            "elements": [
-                {"type": "const_string", "value": "开始"},
-                {"type": "json_schema", "json_schema": {"type": "string"}},
-                {"type": "const_string", "value": "结束"},
-            ],
-        },
-        "开始中间内容",
-        False,
+        [('开始"中间"结束', True), ("开始中间内容", False)],
     ),
     (
         {"type": "tag", "begin": "标签开始", "content": {"type": "any_text"}, "end": "标签结束"},
-        "标签开始一些内容标签结束",
-        True,
-    ),
-    (
-        {"type": "tag", "begin": "标签开始", "content": {"type": "any_text"}, "end": "标签结束"},
-        "标签开始一些内容",
-        False,
+        [("标签开始一些内容标签结束", True), ("标签开始一些内容", False)],
     ),
     (
         {
@@ -1923,19 +2120,7 @@ utf8_stag_format_and_instance_accepted = [
                 {"type": "const_string", "value": "选项二"},
             ],
         },
-        "选项一",
-        True,
-    ),
-    (
-        {
-            "type": "or",
-            "elements": [
-                {"type": "const_string", "value": "选项一"},
-                {"type": "const_string", "value": "选项二"},
-            ],
-        },
-        "选项三",
-        False,
+        [("选项一", True), ("选项三", False)],
     ),
     (
         {
@@ -1943,17 +2128,10 @@ utf8_stag_format_and_instance_accepted = [
             "tags": [{"begin": "项开始", "content": {"type": "any_text"}, "end": "项结束"}],
             "separator": "分隔符",
         },
-        "项开始内容1项结束分隔符项开始内容2项结束",
-        True,
-    ),
-    (
-        {
-            "type": "tags_with_separator",
-            "tags": [{"begin": "项开始", "content": {"type": "any_text"}, "end": "项结束"}],
-            "separator": "分隔符",
-        },
-        "项开始内容1项结束项开始内容2项结束",
-        False,
+        [
+            ("项开始内容1项结束分隔符项开始内容2项结束", True),
+            ("项开始内容1项结束项开始内容2项结束", False),
+        ],
     ),
     (
         {
@@ -1965,8 +2143,7 @@ utf8_stag_format_and_instance_accepted = [
                 "additionalProperties": False,
             },
         },
-        '{"字段": "值"}',
-        True,
+        [('{"字段": "值"}', True)],
     ),
     (
         {
@@ -1978,49 +2155,49 @@ utf8_stag_format_and_instance_accepted = [
                 "additionalProperties": False,
             },
         },
-        "<parameter=参数>值</parameter>",
-        True,
+        [("<parameter=参数>值</parameter>", True)],
     ),
 ]
 
 
 @pytest.mark.parametrize(
-    "stag_format, instance, is_accepted", utf8_stag_format_and_instance_accepted
+    "stag_format, instance_is_accepted_tuples",
+    utf8_stag_format_instance_is_accepted,
+    ids=[stag_format["type"] for stag_format, _ in utf8_stag_format_instance_is_accepted],
 )
-def test_basic_structural_tag_utf8(stag_format: Dict[str, Any], instance: str, is_accepted: bool):
+def test_basic_structural_tag_utf8(
+    stag_format: Dict[str, Any], instance_is_accepted_tuples: List[Tuple[str, bool]]
+):
     """Test structural tag with UTF-8 characters"""
-    check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instances(stag_format, instance_is_accepted_tuples)
 
 
 basic_structural_tags_instance_is_accepted = [
     # ConstStringFormat
-    (xgr.structural_tag.ConstStringFormat(value="hello"), "hello", True),
-    (xgr.structural_tag.ConstStringFormat(value="hello"), "hello world", False),
+    (
+        xgr.structural_tag.ConstStringFormat(value="hello"),
+        [("hello", True), ("hello world", False)],
+    ),
     # JSONSchemaFormat
-    (xgr.structural_tag.JSONSchemaFormat(json_schema={"type": "object"}), '{"key": "value"}', True),
-    (xgr.structural_tag.JSONSchemaFormat(json_schema={"type": "string"}), '"abc"', True),
-    (xgr.structural_tag.JSONSchemaFormat(json_schema={"type": "integer"}), "123", True),
-    (xgr.structural_tag.JSONSchemaFormat(json_schema={"type": "integer"}), "abc", False),
-    # JSONSchemaFormat with style="qwen_xml"
     (
-        xgr.structural_tag.JSONSchemaFormat(
-            json_schema={"type": "object", "properties": {"name": {"type": "string"}}},
-            style="qwen_xml",
-        ),
-        "<parameter=name>value</parameter>",
-        True,
+        xgr.structural_tag.JSONSchemaFormat(json_schema={"type": "object"}),
+        [('{"key": "value"}', True)],
     ),
+    (xgr.structural_tag.JSONSchemaFormat(json_schema={"type": "string"}), [('"abc"', True)]),
+    (
+        xgr.structural_tag.JSONSchemaFormat(json_schema={"type": "integer"}),
+        [("123", True), ("abc", False)],
+    ),
+    # JSONSchemaFormat with style="qwen_xml"
     (
         xgr.structural_tag.JSONSchemaFormat(
             json_schema={"type": "object", "properties": {"name": {"type": "string"}}},
             style="qwen_xml",
         ),
-        "<parameter=name>value</param>",
-        False,
+        [("<parameter=name>value</parameter>", True), ("<parameter=name>value</param>", False)],
     ),
     # AnyTextFormat
-    (xgr.structural_tag.AnyTextFormat(), "", True),
-    (xgr.structural_tag.AnyTextFormat(), "any text here", True),
+    (xgr.structural_tag.AnyTextFormat(), [("", True), ("any text here", True)]),
     # SequenceFormat
     (
         xgr.structural_tag.SequenceFormat(
@@ -2029,18 +2206,7 @@ basic_structural_tags_instance_is_accepted = [
                 xgr.structural_tag.ConstStringFormat(value="B"),
             ]
         ),
-        "AB",
-        True,
-    ),
-    (
-        xgr.structural_tag.SequenceFormat(
-            elements=[
-                xgr.structural_tag.ConstStringFormat(value="A"),
-                xgr.structural_tag.ConstStringFormat(value="B"),
-            ]
-        ),
-        "A",
-        False,
+        [("AB", True), ("A", False)],
     ),
     # OrFormat
     (
@@ -2050,43 +2216,14 @@ basic_structural_tags_instance_is_accepted = [
                 xgr.structural_tag.ConstStringFormat(value="B"),
             ]
         ),
-        "A",
-        True,
-    ),
-    (
-        xgr.structural_tag.OrFormat(
-            elements=[
-                xgr.structural_tag.ConstStringFormat(value="A"),
-                xgr.structural_tag.ConstStringFormat(value="B"),
-            ]
-        ),
-        "B",
-        True,
-    ),
-    (
-        xgr.structural_tag.OrFormat(
-            elements=[
-                xgr.structural_tag.ConstStringFormat(value="A"),
-                xgr.structural_tag.ConstStringFormat(value="B"),
-            ]
-        ),
-        "C",
-        False,
+        [("A", True), ("B", True), ("C", False)],
     ),
     # TagFormat
     (
         xgr.structural_tag.TagFormat(
             begin="<b>", content=xgr.structural_tag.AnyTextFormat(), end="</b>"
         ),
-        "<b>text</b>",
-        True,
-    ),
-    (
-        xgr.structural_tag.TagFormat(
-            begin="<b>", content=xgr.structural_tag.AnyTextFormat(), end="</b>"
-        ),
-        "<b>text</b",
-        False,
+        [("<b>text</b>", True), ("<b>text</b", False)],
     ),
     # TagsWithSeparatorFormat
     (
@@ -2098,69 +2235,66 @@ basic_structural_tags_instance_is_accepted = [
             ],
             separator=",",
         ),
-        '<b>"1"</b>,<b>"2"</b>',
-        True,
-    ),
-    (
-        xgr.structural_tag.TagsWithSeparatorFormat(
-            tags=[
-                xgr.structural_tag.TagFormat(
-                    begin="<b>", content=xgr.structural_tag.AnyTextFormat(), end="</b>"
-                )
-            ],
-            separator=",",
-        ),
-        '<b>"1"</b><b>"2"</b>',
-        False,
+        [('<b>"1"</b>,<b>"2"</b>', True), ('<b>"1"</b><b>"2"</b>', False)],
     ),
     # QwenXMLParameterFormat
     (
         xgr.structural_tag.QwenXMLParameterFormat(
             json_schema={"type": "object", "properties": {"name": {"type": "string"}}}
         ),
-        "<parameter=name>value</parameter>",
-        True,
-    ),
-    (
-        xgr.structural_tag.QwenXMLParameterFormat(
-            json_schema={"type": "object", "properties": {"name": {"type": "string"}}}
-        ),
-        "<parameter=name>value</param>",
-        False,
+        [("<parameter=name>value</parameter>", True), ("<parameter=name>value</param>", False)],
     ),
 ]
 
 
 @pytest.mark.parametrize(
-    "stag_format, instance, is_accepted", basic_structural_tags_instance_is_accepted
+    "stag_format, instance_is_accepted_tuples",
+    basic_structural_tags_instance_is_accepted,
+    ids=[stag_format.type for stag_format, _ in basic_structural_tags_instance_is_accepted],
 )
 def test_from_structural_tag_with_structural_tag_instance(
-    stag_format: xgr.structural_tag.Format, instance: str, is_accepted: bool
+    stag_format: xgr.structural_tag.Format, instance_is_accepted_tuples: List[Tuple[str, bool]]
 ):
     stag = xgr.StructuralTag(format=stag_format)
-    check_stag_with_instance(stag, instance, is_accepted)
+    check_stag_with_instances(stag, instance_is_accepted_tuples)
 
 
 # ---------- Multiple End Tokens Tests ----------
 
 
-multiple_end_tokens_tag_stag_grammar = [
+_MULTIPLE_END_TOKENS_TAG_FORMAT = {
+    "type": "tag",
+    "begin": "BEG",
+    "content": {"type": "const_string", "value": "CONTENT"},
+    "end": ["END1", "END2"],
+}
+_MULTIPLE_END_TOKENS_ANY_TEXT_FORMAT = {
+    "type": "tag",
+    "begin": "BEG",
+    "content": {"type": "any_text"},
+    "end": ["END1", "END2"],
+}
+_MULTIPLE_END_TOKENS_WITH_EMPTY_FORMAT = {
+    "type": "tag",
+    "begin": "BEG",
+    "content": {"type": "const_string", "value": "CONTENT"},
+    "end": ["END1", ""],
+}
+
+
+multiple_end_tokens_stag_grammar = [
     # Test tag with multiple end tokens (limited content)
-    (
-        {
-            "type": "tag",
-            "begin": "BEG",
-            "content": {"type": "const_string", "value": "CONTENT"},
-            "end": ["END1", "END2"],
-        },
+    pytest.param(
+        _MULTIPLE_END_TOKENS_TAG_FORMAT,
         r"""const_string ::= (("CONTENT"))
 tag_end ::= (("END1") | ("END2"))
 tag ::= (("BEG" const_string tag_end))
 root ::= ((tag))
 """,
+        id="tag",
     ),
     # Test tag with single end token in array (should work the same as string)
-    (
+    pytest.param(
         {
             "type": "tag",
             "begin": "<start>",
@@ -2171,38 +2305,11 @@ root ::= ((tag))
 tag ::= (("<start>" const_string "</end>"))
 root ::= ((tag))
 """,
+        id="single_end",
     ),
-]
-
-
-multiple_end_tokens_instance_is_accepted = [
-    ("BEGCONTENTEND1", True),
-    ("BEGCONTENTEND2", True),
-    ("BEGCONTENTEND3", False),
-    ("BEGCONTENTEND", False),
-]
-
-
-@pytest.mark.parametrize("stag_format, expected_grammar", multiple_end_tokens_tag_stag_grammar)
-def test_multiple_end_tokens_tag_grammar(stag_format: Dict[str, Any], expected_grammar: str):
-    check_stag_with_grammar(stag_format, expected_grammar)
-
-
-@pytest.mark.parametrize("instance, is_accepted", multiple_end_tokens_instance_is_accepted)
-def test_multiple_end_tokens_tag_instance(instance: str, is_accepted: bool):
-    stag_format = {
-        "type": "tag",
-        "begin": "BEG",
-        "content": {"type": "const_string", "value": "CONTENT"},
-        "end": ["END1", "END2"],
-    }
-    check_stag_with_instance(stag_format, instance, is_accepted)
-
-
-# Test multiple end tokens with any_text (unlimited content)
-multiple_end_tokens_any_text_stag_grammar = [
-    (
-        {"type": "tag", "begin": "BEG", "content": {"type": "any_text"}, "end": ["END1", "END2"]},
+    # Test multiple end tokens with any_text (unlimited content)
+    pytest.param(
+        _MULTIPLE_END_TOKENS_ANY_TEXT_FORMAT,
         r"""any_text ::= TagDispatch(
   stop_eos=false,
   stop_str=("END1", "END2"),
@@ -2212,56 +2319,20 @@ multiple_end_tokens_any_text_stag_grammar = [
 tag ::= (("BEG" any_text))
 root ::= ((tag))
 """,
-    )
-]
-
-
-multiple_end_tokens_any_text_instance_is_accepted = [
-    ("BEGHello!END1", True),
-    ("BEGHello!END2", True),
-    ("BEGEND1", True),
-    ("BEGEND2", True),
-    ("BEGsome text hereEND1", True),
-    ("BEGsome text hereEND2", True),
-    ("BEGHello!END3", False),
-    ("BEGHello!END", False),
-]
-
-
-@pytest.mark.parametrize("stag_format, expected_grammar", multiple_end_tokens_any_text_stag_grammar)
-def test_multiple_end_tokens_any_text_grammar(stag_format: Dict[str, Any], expected_grammar: str):
-    check_stag_with_grammar(stag_format, expected_grammar)
-
-
-@pytest.mark.parametrize("instance, is_accepted", multiple_end_tokens_any_text_instance_is_accepted)
-def test_multiple_end_tokens_any_text_instance(instance: str, is_accepted: bool):
-    stag_format = {
-        "type": "tag",
-        "begin": "BEG",
-        "content": {"type": "any_text"},
-        "end": ["END1", "END2"],
-    }
-    check_stag_with_instance(stag_format, instance, is_accepted)
-
-
-# Test multiple end tokens with one empty string
-multiple_end_tokens_with_empty_stag_grammar = [
+        id="any_text",
+    ),
     # Test tag with one actual end token and one empty string
-    (
-        {
-            "type": "tag",
-            "begin": "BEG",
-            "content": {"type": "const_string", "value": "CONTENT"},
-            "end": ["END1", ""],
-        },
+    pytest.param(
+        _MULTIPLE_END_TOKENS_WITH_EMPTY_FORMAT,
         r"""const_string ::= (("CONTENT"))
 tag_end ::= ("" | ("END1"))
 tag ::= (("BEG" const_string tag_end))
 root ::= ((tag))
 """,
+        id="with_empty",
     ),
     # Test with empty string first
-    (
+    pytest.param(
         {
             "type": "tag",
             "begin": "<start>",
@@ -2273,10 +2344,48 @@ tag_end ::= ("" | ("</end>"))
 tag ::= (("<start>" const_string tag_end))
 root ::= ((tag))
 """,
+        id="empty_first",
     ),
 ]
 
 
+@pytest.mark.parametrize("stag_format, expected_grammar", multiple_end_tokens_stag_grammar)
+def test_multiple_end_tokens_grammar(stag_format: Dict[str, Any], expected_grammar: str):
+    check_stag_with_grammar(stag_format, expected_grammar)
+
+
+multiple_end_tokens_instance_is_accepted = [
+    ("BEGCONTENTEND1", True),
+    ("BEGCONTENTEND2", True),
+    ("BEGCONTENTEND3", False),
+    ("BEGCONTENTEND", False),
+]
+
+
+@pytest.mark.parametrize("instance, is_accepted", multiple_end_tokens_instance_is_accepted)
+def test_multiple_end_tokens_tag_instance(instance: str, is_accepted: bool):
+    check_stag_with_instance(_MULTIPLE_END_TOKENS_TAG_FORMAT, instance, is_accepted)
+
+
+# Test multiple end tokens with any_text (unlimited content)
+multiple_end_tokens_any_text_instance_is_accepted = [
+    ("BEGHello!END1", True),
+    ("BEGHello!END2", True),
+    ("BEGEND1", True),
+    ("BEGEND2", True),
+    ("BEGsome text hereEND1", True),
+    ("BEGsome text hereEND2", True),
+    ("BEGHello!END3", False),
+    ("BEGHello!END", False),
+]
+
+
+@pytest.mark.parametrize("instance, is_accepted", multiple_end_tokens_any_text_instance_is_accepted)
+def test_multiple_end_tokens_any_text_instance(instance: str, is_accepted: bool):
+    check_stag_with_instance(_MULTIPLE_END_TOKENS_ANY_TEXT_FORMAT, instance, is_accepted)
+
+
+# Test multiple end tokens with one empty string
 multiple_end_tokens_with_empty_instance_is_accepted = [
     ("BEGCONTENTEND1", True),  # Ends with END1
     ("BEGCONTENT", True),  # Ends with empty string
@@ -2285,53 +2394,32 @@ multiple_end_tokens_with_empty_instance_is_accepted = [
 ]
 
 
-@pytest.mark.parametrize(
-    "stag_format, expected_grammar", multiple_end_tokens_with_empty_stag_grammar
-)
-def test_multiple_end_tokens_with_empty_grammar(stag_format: Dict[str, Any], expected_grammar: str):
-    check_stag_with_grammar(stag_format, expected_grammar)
-
-
 @pytest.mark.parametrize(
     "instance, is_accepted", multiple_end_tokens_with_empty_instance_is_accepted
 )
 def test_multiple_end_tokens_with_empty_instance(instance: str, is_accepted: bool):
-    stag_format = {
-        "type": "tag",
-        "begin": "BEG",
-        "content": {"type": "const_string", "value": "CONTENT"},
-        "end": ["END1", ""],
-    }
-    check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instance(_MULTIPLE_END_TOKENS_WITH_EMPTY_FORMAT, instance, is_accepted)
 
 
 # Test multiple end tokens with Python API
 def test_multiple_end_tokens_python_api():
     """Test that TagFormat accepts both str and List[str] for end field"""
+    content = xgr.structural_tag.ConstStringFormat(value="content")
+
     # Test with single string (backward compatible)
-    tag1 = xgr.structural_tag.TagFormat(
-        begin="<start>", content=xgr.structural_tag.ConstStringFormat(value="content"), end="</end>"
-    )
+    tag1 = xgr.structural_tag.TagFormat(begin="<start>", content=content, end="</end>")
     assert tag1.end == "</end>"
 
     # Test with list of strings
     tag2 = xgr.structural_tag.TagFormat(
-        begin="<start>",
-        content=xgr.structural_tag.ConstStringFormat(value="content"),
-        end=["</end1>", "</end2>"],
+        begin="<start>", content=content, end=["</end1>", "</end2>"]
     )
     assert tag2.end == ["</end1>", "</end2>"]
 
-    # Test that both work in StructuralTag
-    stag1 = xgr.StructuralTag(format=tag1)
-    stag2 = xgr.StructuralTag(format=tag2)
-
-    # Test that the grammars can be created
-    grammar1 = xgr.Grammar.from_structural_tag(stag1)
-    grammar2 = xgr.Grammar.from_structural_tag(stag2)
-
-    assert grammar1 is not None
-    assert grammar2 is not None
+    # Test that both work in StructuralTag and the grammars can be created
+    for tag in (tag1, tag2):
+        grammar = xgr.Grammar.from_structural_tag(xgr.StructuralTag(format=tag))
+        assert grammar is not None
 
 
 # Test error case: empty end array
@@ -2346,9 +2434,8 @@ def test_multiple_end_tokens_empty_array_error():
             "end": [],
         },
     }
-    with pytest.raises(Exception) as exc_info:
+    with pytest.raises(xgr.InvalidStructuralTagError, match="(?i)empty"):
         xgr.Grammar.from_structural_tag(stag_format)
-    assert "empty" in str(exc_info.value).lower()
 
 
 # Test error case: unlimited content with all empty end strings
@@ -2358,14 +2445,140 @@ def test_multiple_end_tokens_unlimited_empty_error():
         "type": "structural_tag",
         "format": {"type": "tag", "begin": "BEG", "content": {"type": "any_text"}, "end": ["", ""]},
     }
-    with pytest.raises(Exception) as exc_info:
+    with pytest.raises(xgr.InvalidStructuralTagError, match="(?i)empty"):
         xgr.Grammar.from_structural_tag(stag_format)
-    assert "non-empty" in str(exc_info.value).lower() or "empty" in str(exc_info.value).lower()
 
 
 # ---------- Excludes Tests ----------
 
 
+_EXCLUDES_ANY_TEXT_FORMAT = {
+    "type": "tag",
+    "content": {"type": "any_text", "excludes": ["<end>", "</tag>"]},
+    "begin": "",
+    "end": ".",
+}
+_EXCLUDES_TRIGGERED_FORMAT = {
+    "type": "triggered_tags",
+    "triggers": ["A"],
+    "tags": [
+        {"begin": "A1", "content": {"type": "const_string", "value": "L1"}, "end": "A"},
+        {"begin": "A2", "content": {"type": "const_string", "value": "L2"}, "end": "A"},
+    ],
+    "at_least_one": True,
+    "stop_after_first": False,
+    "excludes": ["L1", "L2"],
+}
+_EXCLUDES_SINGLE_ANY_TEXT_FORMAT = {"type": "any_text", "excludes": ["ABC"]}
+_EXCLUDES_ANY_TEXT_WITHIN_SEQUENCE_FORMAT = {
+    "type": "sequence",
+    "elements": [
+        {"type": "any_text", "excludes": ["ABC"]},
+        {"type": "const_string", "value": "ABC"},
+    ],
+}
+_EXCLUDES_TRIGGERED_TAGS_WITHOUT_END_FORMAT = {
+    "type": "sequence",
+    "elements": [
+        {
+            "type": "triggered_tags",
+            "triggers": ["1"],
+            "tags": [{"begin": "1", "content": {"type": "any_text"}, "end": ["1"]}],
+            "excludes": ["ABC"],
+        },
+        {"type": "const_string", "value": "ABC"},
+    ],
+}
+
+
+excludes_stag_grammar = [
+    pytest.param(
+        _EXCLUDES_ANY_TEXT_FORMAT,
+        r"""any_text ::= TagDispatch(
+  stop_eos=false,
+  stop_str=("."),
+  loop_after_dispatch=false,
+  excludes=("<end>", "</tag>")
+)
+tag ::= (("" any_text))
+root ::= ((tag))
+""",
+        id="any_text",
+    ),
+    pytest.param(
+        _EXCLUDES_TRIGGERED_FORMAT,
+        r"""const_string ::= (("L1"))
+const_string_1 ::= (("L2"))
+triggered_tags_group ::= (("1" const_string "A") | ("2" const_string_1 "A"))
+triggered_tags_first ::= (("A1" const_string "A") | ("A2" const_string_1 "A"))
+triggered_tags_sub ::= TagDispatch(
+  ("A", triggered_tags_group),
+  stop_eos=true,
+  stop_str=(),
+  loop_after_dispatch=true,
+  excludes=("L1", "L2")
+)
+triggered_tags ::= ((triggered_tags_first triggered_tags_sub))
+root ::= ((triggered_tags))
+""",
+        id="triggered",
+    ),
+    pytest.param(
+        _EXCLUDES_SINGLE_ANY_TEXT_FORMAT,
+        r"""any_text ::= TagDispatch(
+  stop_eos=true,
+  stop_str=(),
+  loop_after_dispatch=false,
+  excludes=("ABC")
+)
+root ::= ((any_text))
+""",
+        id="single_any_text",
+    ),
+    pytest.param(
+        _EXCLUDES_ANY_TEXT_WITHIN_SEQUENCE_FORMAT,
+        r"""any_text ::= TagDispatch(
+  stop_eos=true,
+  stop_str=(),
+  loop_after_dispatch=false,
+  excludes=("ABC")
+)
+const_string ::= (("ABC"))
+sequence ::= ((any_text const_string))
+root ::= ((sequence))
+""",
+        id="any_text_within_sequence",
+    ),
+    pytest.param(
+        _EXCLUDES_TRIGGERED_TAGS_WITHOUT_END_FORMAT,
+        r"""any_text ::= TagDispatch(
+  stop_eos=false,
+  stop_str=("1"),
+  loop_after_dispatch=false,
+  excludes=()
+)
+triggered_tags_group ::= (("" any_text))
+triggered_tags ::= TagDispatch(
+  ("1", triggered_tags_group),
+  stop_eos=true,
+  stop_str=(),
+  loop_after_dispatch=true,
+  excludes=("ABC")
+)
+const_string ::= (("ABC"))
+sequence ::= ((triggered_tags const_string))
+root ::= ((sequence))
+""",
+        id="triggered_tags_without_end",
+    ),
+]
+
+
+@pytest.mark.parametrize("stag_format, expected_grammar", excludes_stag_grammar)
+def test_excludes_grammar(stag_format: Dict[str, Any], expected_grammar: str):
+    check_stag_with_grammar(stag_format, expected_grammar)
+
+
 test_strings_is_accepted_any_text_excludes = [
     ("This is a test string.", True),
     ("This string contains <end> which is excluded.", False),
@@ -2378,26 +2591,7 @@ test_strings_is_accepted_any_text_excludes = [
 
 @pytest.mark.parametrize("instance, is_accepted", test_strings_is_accepted_any_text_excludes)
 def test_excluded_strings_in_any_text(instance: str, is_accepted: bool):
-
-    stag_format = {
-        "type": "tag",
-        "content": {"type": "any_text", "excludes": ["<end>", "</tag>"]},
-        "begin": "",
-        "end": ".",
-    }
-
-    expected_grammar = r"""any_text ::= TagDispatch(
-  stop_eos=false,
-  stop_str=("."),
-  loop_after_dispatch=false,
-  excludes=("<end>", "</tag>")
-)
-tag ::= (("" any_text))
-root ::= ((tag))
-"""
-
-    check_stag_with_grammar(stag_format, expected_grammar)
-    check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instance(_EXCLUDES_ANY_TEXT_FORMAT, instance, is_accepted)
 
 
 test_strings_is_accepted_triggered_excludes = [
@@ -2414,36 +2608,7 @@ test_strings_is_accepted_triggered_excludes = [
 
 @pytest.mark.parametrize("instance, is_accepted", test_strings_is_accepted_triggered_excludes)
 def test_excluded_strings_in_triggered_format(instance: str, is_accepted: bool):
-
-    stag_format = {
-        "type": "triggered_tags",
-        "triggers": ["A"],
-        "tags": [
-            {"begin": "A1", "content": {"type": "const_string", "value": "L1"}, "end": "A"},
-            {"begin": "A2", "content": {"type": "const_string", "value": "L2"}, "end": "A"},
-        ],
-        "at_least_one": True,
-        "stop_after_first": False,
-        "excludes": ["L1", "L2"],
-    }
-
-    expected_grammar = r"""const_string ::= (("L1"))
-const_string_1 ::= (("L2"))
-triggered_tags_group ::= (("1" const_string "A") | ("2" const_string_1 "A"))
-triggered_tags_first ::= (("A1" const_string "A") | ("A2" const_string_1 "A"))
-triggered_tags_sub ::= TagDispatch(
-  ("A", triggered_tags_group),
-  stop_eos=true,
-  stop_str=(),
-  loop_after_dispatch=true,
-  excludes=("L1", "L2")
-)
-triggered_tags ::= ((triggered_tags_first triggered_tags_sub))
-root ::= ((triggered_tags))
-"""
-
-    check_stag_with_grammar(stag_format, expected_grammar)
-    check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instance(_EXCLUDES_TRIGGERED_FORMAT, instance, is_accepted)
 
 
 test_strings_is_accepted_single_excludes = [
@@ -2458,20 +2623,7 @@ test_strings_is_accepted_single_excludes = [
 
 @pytest.mark.parametrize("instance, is_accepted", test_strings_is_accepted_single_excludes)
 def test_excluded_strings_in_single_any_text(instance: str, is_accepted: bool):
-
-    format = {"type": "any_text", "excludes": ["ABC"]}
-
-    expected_grammar = r"""any_text ::= TagDispatch(
-  stop_eos=true,
-  stop_str=(),
-  loop_after_dispatch=false,
-  excludes=("ABC")
-)
-root ::= ((any_text))
-"""
-
-    check_stag_with_grammar(format, expected_grammar)
-    check_stag_with_instance(format, instance, is_accepted)
+    check_stag_with_instance(_EXCLUDES_SINGLE_ANY_TEXT_FORMAT, instance, is_accepted)
 
 
 test_strings_is_accepted_excluded_any_text_within_sequence = [
@@ -2488,28 +2640,7 @@ test_strings_is_accepted_excluded_any_text_within_sequence = [
     "instance, is_accepted", test_strings_is_accepted_excluded_any_text_within_sequence
 )
 def test_excluded_any_text_within_sequence(instance: str, is_accepted: bool):
-
-    format = {
-        "type": "sequence",
-        "elements": [
-            {"type": "any_text", "excludes": ["ABC"]},
-            {"type": "const_string", "value": "ABC"},
-        ],
-    }
-
-    expected_grammar = r"""any_text ::= TagDispatch(
-  stop_eos=true,
-  stop_str=(),
-  loop_after_dispatch=false,
-  excludes=("ABC")
-)
-const_string ::= (("ABC"))
-sequence ::= ((any_text const_string))
-root ::= ((sequence))
-"""
-
-    check_stag_with_grammar(format, expected_grammar)
-    check_stag_with_instance(format, instance, is_accepted)
+    check_stag_with_instance(_EXCLUDES_ANY_TEXT_WITHIN_SEQUENCE_FORMAT, instance, is_accepted)
 
 
 test_strings_is_accepted_excluded_triggered_tags_without_end = [
@@ -2525,41 +2656,7 @@ test_strings_is_accepted_excluded_triggered_tags_without_end = [
     "instance, is_accepted", test_strings_is_accepted_excluded_triggered_tags_without_end
 )
 def test_excludes_triggered_tags_without_end(instance: str, is_accepted: bool):
-
-    stag = {
-        "type": "sequence",
-        "elements": [
-            {
-                "type": "triggered_tags",
-                "triggers": ["1"],
-                "tags": [{"begin": "1", "content": {"type": "any_text"}, "end": ["1"]}],
-                "excludes": ["ABC"],
-            },
-            {"type": "const_string", "value": "ABC"},
-        ],
-    }
-
-    expected_grammar = r"""any_text ::= TagDispatch(
-  stop_eos=false,
-  stop_str=("1"),
-  loop_after_dispatch=false,
-  excludes=()
-)
-triggered_tags_group ::= (("" any_text))
-triggered_tags ::= TagDispatch(
-  ("1", triggered_tags_group),
-  stop_eos=true,
-  stop_str=(),
-  loop_after_dispatch=true,
-  excludes=("ABC")
-)
-const_string ::= (("ABC"))
-sequence ::= ((triggered_tags const_string))
-root ::= ((sequence))
-"""
-
-    check_stag_with_grammar(stag, expected_grammar)
-    check_stag_with_instance(stag, instance, is_accepted)
+    check_stag_with_instance(_EXCLUDES_TRIGGERED_TAGS_WITHOUT_END_FORMAT, instance, is_accepted)
 
 
 # ---------- Regex Excludes Tests ----------
@@ -2567,6 +2664,19 @@ root ::= ((sequence))
 # Note: Regex excludes work using substring matching semantics.
 # Strings containing any excluded substring are rejected.
 
+_REGEX_EXCLUDES_BASIC_FORMAT = {
+    "type": "regex",
+    "pattern": "[a-c]+",
+    "excludes": ["bac"],  # Excludes strings containing "bac"
+}
+_REGEX_EXCLUDES_SUBSTRING_FORMAT = {
+    "type": "regex",
+    "pattern": "[a-z]+",
+    "excludes": ["foo", "bar"],
+}
+_REGEX_EXCLUDES_SINGLE_FORMAT = {"type": "regex", "pattern": "[a-z]+", "excludes": ["bad"]}
+
+
 test_strings_is_accepted_regex_excludes = [
     # Basic matching - these match the pattern and don't contain excluded substring
     ("abc", True),
@@ -2587,13 +2697,7 @@ test_strings_is_accepted_regex_excludes = [
 @pytest.mark.parametrize("instance, is_accepted", test_strings_is_accepted_regex_excludes)
 def test_regex_with_excludes_basic(instance: str, is_accepted: bool):
     """Test regex format with simple excludes (substring matching semantics)"""
-    stag_format = {
-        "type": "regex",
-        "pattern": "[a-c]+",
-        "excludes": ["bac"],  # Excludes strings containing "bac"
-    }
-
-    check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instance(_REGEX_EXCLUDES_BASIC_FORMAT, instance, is_accepted)
 
 
 test_strings_is_accepted_regex_excludes_substring = [
@@ -2614,13 +2718,7 @@ test_strings_is_accepted_regex_excludes_substring = [
 @pytest.mark.parametrize("instance, is_accepted", test_strings_is_accepted_regex_excludes_substring)
 def test_regex_with_excludes_substring(instance: str, is_accepted: bool):
     """Test regex format excludes use substring matching semantics"""
-    stag_format = {
-        "type": "regex",
-        "pattern": "[a-z]+",
-        "excludes": ["foo", "bar"],
-    }
-
-    check_stag_with_instance(stag_format, instance, is_accepted)
+    check_stag_with_instance(_REGEX_EXCLUDES_SUBSTRING_FORMAT, instance, is_accepted)
 
 
 test_strings_is_accepted_regex_excludes_single = [
@@ -2639,13 +2737,63 @@ test_strings_is_accepted_regex_excludes_single = [
 @pytest.mark.parametrize("instance, is_accepted", test_strings_is_accepted_regex_excludes_single)
 def test_regex_with_excludes_single(instance: str, is_accepted: bool):
     """Test regex excludes with a single excluded string (substring matching)"""
-    stag_format = {
-        "type": "regex",
-        "pattern": "[a-z]+",
-        "excludes": ["bad"],
-    }
+    check_stag_with_instance(_REGEX_EXCLUDES_SINGLE_FORMAT, instance, is_accepted)
 
-    check_stag_with_instance(stag_format, instance, is_accepted)
+
+# The automaton of the excluded and end strings must follow the longest suffix of the text that
+# is a prefix of some string, not only the single-character ones.
+aho_corasick_suffix_stag_format_instance_is_accepted = [
+    pytest.param(
+        {"type": "regex", "pattern": "[a-z]+", "excludes": ["aab", "cd", "abce"]},
+        [("aaab", False), ("abcd", False), ("abce", False), ("abcf", True), ("abab", True)],
+        id="regex_excludes",
+    ),
+    pytest.param(
+        {"type": "any_text", "excludes": ["aab"]},
+        [("aaab", False), ("abaab", False), ("abab", True)],
+        id="any_text_excludes",
+    ),
+    pytest.param(
+        {"type": "tag", "begin": "", "content": {"type": "any_text"}, "end": "aab"},
+        [("aab", True), ("aaab", True), ("abaab", True), ("aaba", False)],
+        id="tag_end",
+    ),
+    # The trigger that is matched first dispatches, even inside a partial match of a longer one.
+    pytest.param(
+        {
+            "type": "triggered_tags",
+            "triggers": ["abc", "b"],
+            "tags": [
+                {"begin": "abc", "content": {"type": "const_string", "value": "Y"}, "end": ""},
+                {"begin": "b", "content": {"type": "const_string", "value": "Z"}, "end": ""},
+            ],
+            "excludes": ["Z"],
+        },
+        [("bZ", True), ("abZ", True), ("aabZ", True), ("ab", False), ("abcY", False)],
+        id="overlapping_triggers",
+    ),
+    pytest.param(
+        {
+            "type": "triggered_tags",
+            "triggers": ["abc"],
+            "tags": [
+                {"begin": "abc", "content": {"type": "const_string", "value": "Y"}, "end": ""}
+            ],
+            "excludes": ["bc", "bd"],
+        },
+        [("abcY", True), ("aabcY", True), ("abY", True), ("abd", False), ("xbcY", False)],
+        id="trigger_overlapping_excludes",
+    ),
+]
+
+
+@pytest.mark.parametrize(
+    "stag_format, instance_is_accepted_tuples", aho_corasick_suffix_stag_format_instance_is_accepted
+)
+def test_excludes_and_ends_with_overlapping_suffix(
+    stag_format: Dict[str, Any], instance_is_accepted_tuples: List[Tuple[str, bool]]
+):
+    check_stag_with_instances(stag_format, instance_is_accepted_tuples)
 
 
 def test_regex_excludes_empty_list():
@@ -2663,9 +2811,8 @@ def test_regex_excludes_parsing_error():
         "type": "structural_tag",
         "format": {"type": "regex", "pattern": "[a-z]+", "excludes": "not_an_array"},
     }
-    with pytest.raises(Exception) as exc_info:
+    with pytest.raises(xgr.InvalidStructuralTagError, match="(?i)array"):
         xgr.Grammar.from_structural_tag(stag_format)
-    assert "array" in str(exc_info.value).lower()
 
 
 def test_regex_excludes_empty_string_error():
@@ -2674,9 +2821,8 @@ def test_regex_excludes_empty_string_error():
         "type": "structural_tag",
         "format": {"type": "regex", "pattern": "[a-z]+", "excludes": ["valid", ""]},
     }
-    with pytest.raises(Exception) as exc_info:
+    with pytest.raises(xgr.InvalidStructuralTagError, match="(?i)empty"):
         xgr.Grammar.from_structural_tag(stag_format)
-    assert "non-empty" in str(exc_info.value).lower() or "empty" in str(exc_info.value).lower()
 
 
 if __name__ == "__main__":